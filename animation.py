@@ -0,0 +1,107 @@
+import bpy
+import numpy as np
+
+import grid_order
+
+class ShapeAnimation:
+    """
+    Animate the parameters of an ExtrudedShape over a range of frames.
+
+    The u/v topology of the mesh is the same on every frame, so the mesh
+    is only built once. After that, each frame only recomputes the vertex
+    positions and writes them into Blender in bulk.
+    """
+    def __init__(
+            self, shape_class, u_res, v_res, frame_params,
+            ordering='column'):
+        """
+        shape_class: an ExtrudedShape subclass like shapes.SuperSeashell
+        u_res, v_res: resolution of the mesh, fixed for the whole animation
+        frame_params: a function f(frame) that returns a dict of
+            parameters for the shape on that frame
+        ordering: vertex/face order of the mesh, see grid_order.ORDERINGS
+        """
+        self.shape_class = shape_class
+        self.u_res = u_res
+        self.v_res = v_res
+        self.frame_params = frame_params
+        self.ordering = ordering
+        self.vertex_order, _ = grid_order.ordered_mesh(u_res, v_res, ordering)
+
+    def make_shape(self, frame):
+        params = self.frame_params(frame)
+        return self.shape_class(self.u_res, self.v_res, **params)
+
+    def frame_coords(self, frame):
+        """
+        Compute the vertex coordinates for a frame as a flat array in the
+        same order as the mesh vertices, ready for foreach_set()
+        """
+        grid = self.make_shape(frame).make_grid(np.float32)
+        return grid.reshape(-1, 3)[self.vertex_order].reshape(-1)
+
+    def build(self, name, frame):
+        """
+        Build the mesh once using the parameters at the given frame.
+        Returns the new object.
+        """
+        return self.make_shape(frame).build(name, ordering=self.ordering)
+
+    def update(self, obj, frame):
+        """
+        Overwrite the vertices of a mesh made by build() with the shape
+        at another frame.
+        """
+        mesh = obj.data
+        mesh.vertices.foreach_set('co', self.frame_coords(frame))
+        mesh.update()
+
+    def bake_shape_keys(self, obj, frames):
+        """
+        Store every frame as a shape key on obj. Each key is keyframed
+        to 1.0 on its own frame and 0.0 on the neighboring frames so the
+        animation plays back (and renders) without any Python handlers.
+        """
+        if obj.data.shape_keys is None:
+            obj.shape_key_add(name='Basis', from_mix=False)
+
+        for frame in frames:
+            key = obj.shape_key_add(name='frame_{}'.format(frame),
+                from_mix=False)
+            key.data.foreach_set('co', self.frame_coords(frame))
+
+            pulse = [(frame - 1, 0.0), (frame, 1.0), (frame + 1, 0.0)]
+            for keyframe, value in pulse:
+                key.value = value
+                key.keyframe_insert('value', frame=keyframe)
+
+    def bake_cache(self, filename, frames):
+        """
+        Compute the coordinates for every frame and save them to a .npy
+        file with one row per frame.
+        """
+        frames = list(frames)
+        coords = np.stack([self.frame_coords(frame) for frame in frames])
+        np.save(filename, coords)
+
+def play_cache(obj, filename, frame_start):
+    """
+    Register a frame change handler that copies the coordinates of the
+    current frame from a file made by ShapeAnimation.bake_cache() into
+    the mesh of obj. The file is memory mapped, so only the current
+    frame is read from disk.
+
+    Returns the handler so it can be removed from
+    bpy.app.handlers.frame_change_pre later.
+    """
+    coords = np.load(filename, mmap_mode='r')
+    mesh = obj.data
+
+    def on_frame_change(scene):
+        row = scene.frame_current - frame_start
+        if 0 <= row < len(coords):
+            mesh.vertices.foreach_set('co', np.array(coords[row]))
+            mesh.update()
+
+    bpy.app.handlers.frame_change_pre.append(on_frame_change)
+    return on_frame_change
@@ -1,9 +1,14 @@
 import math
+import bisect
+import numbers
 import operator
 import functools
 
+import numpy as np
 from mathutils import Vector
 
+import util
+
 class CrossSection:
     """
     Parametric curve that represents
@@ -25,6 +30,19 @@ class CrossSection:
         """
         raise NotImplementedError
 
+    def positions(self, us, v):
+        """
+        Batched version of position() for an array of u values at a
+        single v.
+
+        Returns a float64 array with shape (len(us), 3). Subclasses can
+        override this with something faster
+        """
+        result = np.empty((len(us), 3))
+        for k, u in enumerate(us):
+            result[k] = self.position(u, v)
+        return result
+
 class Line(CrossSection):
     """
     Line segment pointing along the x-axis starting at the origin
@@ -35,6 +53,11 @@ class Line(CrossSection):
         z = 0.0
         return Vector((x, y, z))
 
+    def positions(self, us, v):
+        result = np.zeros((len(us), 3))
+        result[:, 0] = us
+        return result
+
 class Circle(CrossSection):
     """
     Circular cross section.
@@ -46,6 +69,22 @@ class Circle(CrossSection):
         z = 0.0
         return Vector((x, y, z))
 
+    def positions(self, us, v):
+        """
+        For evenly spaced u values, look up cos/sin in a table instead of
+        calling them for every sample. The table is the same for every v,
+        so it is cached, see util.cached_rotation_samples().
+        """
+        step = util.uniform_step(us)
+        if step is None:
+            return super().positions(us, v)
+
+        theta0 = 2.0 * math.pi * us[0]
+        dtheta = 2.0 * math.pi * step
+        x, y = util.cached_rotation_samples(theta0, dtheta, len(us))
+        z = np.zeros(len(us))
+        return np.stack([x, y, z], axis=1)
+
 class Lissajous(CrossSection):
     """
     Lissajous curves: like the parametric equation for a circle but
@@ -70,6 +109,27 @@ class Lissajous(CrossSection):
         z = 0.0
         return Vector((x, y, z))
 
+    def positions(self, us, v):
+        """
+        For evenly spaced u values, look up cos/sin in a table instead of
+        calling them for every sample. x and y each need their own table
+        since the frequencies differ. The tables are the same for every v,
+        so they are cached, see util.cached_rotation_samples().
+        """
+        step = util.uniform_step(us)
+        if step is None:
+            return super().positions(us, v)
+
+        theta0 = 2.0 * math.pi * us[0]
+        dtheta = 2.0 * math.pi * step
+        count = len(us)
+        x, _ = util.cached_rotation_samples(
+            self.a * theta0, self.a * dtheta, count)
+        _, y = util.cached_rotation_samples(
+            self.b * theta0, self.b * dtheta, count)
+        z = np.zeros(len(us))
+        return np.stack([x, y, z], axis=1)
+
 class RoseCurve(CrossSection):
     def __init__(self, k):
         self.k = k
@@ -82,43 +142,247 @@ class RoseCurve(CrossSection):
         z = 0.0
         return Vector((x, y, z))
 
+    def positions(self, us, v):
+        """
+        For evenly spaced u values, look up cos/sin in a table instead of
+        calling them for every sample. The table is the same for every v,
+        so it is cached, see util.cached_rotation_samples().
+        """
+        step = util.uniform_step(us)
+        if step is None:
+            return super().positions(us, v)
+
+        theta0 = 2.0 * math.pi * us[0]
+        dtheta = 2.0 * math.pi * step
+        radius, _ = util.cached_rotation_samples(
+            self.k * theta0, self.k * dtheta, len(us))
+        c, s = util.cached_rotation_samples(theta0, dtheta, len(us))
+        z = np.zeros(len(us))
+        return np.stack([radius * c, radius * s, z], axis=1)
+
 class Transformed(CrossSection):
     """
     Decorator that applies a transformation to a cross section
     """
-    def __init__(self, original_cs, xform):
+    def __init__(self, original_cs, xform, depends_on_u=True):
         """
         original_cs: the CrossSection to transform
 
         xform: either an XForm object or a function
             f(position, u, v) = an XForm object
+
+        depends_on_u: set this to False if xform is a function that only
+            looks at v. Then positions() calls it once per v and
+            transforms all the samples at once.
         """
         self.original_cs = original_cs
         self.xform = xform
+        self.depends_on_u = depends_on_u
+
+    def get_xform(self, pos, u, v):
+        """
+        If we have a callable, call it to get an xform. If we have a
+        constant xform, just use it.
+        """
+        if callable(self.xform):
+            return self.xform(pos, u, v)
+        else:
+            return self.xform
 
     def position(self, u, v):
         pos = self.original_cs.position(u, v)
-
-        # If we have a callable, call it to get an xform. If we have a
-        # constant xform, just use it.
-        xform = self.xform(pos, u, v) if callable(self.xform) else self.xform
+        xform = self.get_xform(pos, u, v)
         return xform.transform(pos)
 
+    def positions(self, us, v):
+        """
+        Sample the original cross section in one batch, then transform
+        the samples. When the same XForm applies to every sample, they
+        are transformed as one array, otherwise one at a time.
+        """
+        result = self.original_cs.positions(us, v)
+        if not callable(self.xform):
+            return self.xform.transform_points(result)
+        elif not self.depends_on_u:
+            xform = self.xform(Vector(result[0]), us[0], v)
+            return xform.transform_points(result)
+
+        for k, u in enumerate(us):
+            pos = Vector(result[k])
+            xform = self.get_xform(pos, u, v)
+            result[k] = xform.transform(pos)
+        return result
+
+def measure(cs, v=0.5, samples=64):
+    """
+    Estimate the arc length and the total turning angle (in radians) of a
+    cross section at a single v by sampling it as a polyline.
+
+    returns (length, turning)
+    """
+    us = np.linspace(0.0, 1.0, samples + 1)
+    points = cs.positions(us, v)
+
+    segments = np.diff(points, axis=0)
+    lengths = np.linalg.norm(segments, axis=1)
+    directions = util.normalize_rows(segments)
+
+    cosines = np.sum(directions[1:] * directions[:-1], axis=1)
+    turning = np.arccos(np.clip(cosines, -1.0, 1.0))
+    return float(lengths.sum()), float(turning.sum())
+
+def auto_weights(cross_sections, v=0.5):
+    """
+    Weight each cross section by how many samples it needs: its share of
+    the total length plus its share of the total turning angle. Long
+    pieces need samples to keep the spacing even, curvy pieces need
+    samples to keep them smooth.
+    """
+    measurements = [measure(cs, v) for cs in cross_sections]
+    lengths = [length for length, _ in measurements]
+    turnings = [turning for _, turning in measurements]
+
+    total_length = sum(lengths)
+    total_turning = sum(turnings)
+
+    weights = [0.0] * len(cross_sections)
+    for k in range(len(cross_sections)):
+        if total_length > 0.0:
+            weights[k] += lengths[k] / total_length
+        if total_turning > 0.0:
+            weights[k] += turnings[k] / total_turning
+
+    # Everything is a single point, fall back to an even split.
+    if sum(weights) == 0.0:
+        return [1.0] * len(cross_sections)
+    return weights
+
+def column_budget(weights, u_quads):
+    """
+    Split u_quads columns of quads between the pieces in proportion to the
+    weights using the largest remainder method. Each piece gets at least
+    one column if there are enough to go around.
+
+    returns a list of integer column counts that adds up to u_quads
+    """
+    total = float(sum(weights))
+    ideal = [w / total * u_quads for w in weights]
+    counts = [int(x) for x in ideal]
+
+    # Hand out the leftover columns to the largest remainders
+    leftover = u_quads - sum(counts)
+    by_remainder = sorted(
+        range(len(weights)), key=lambda k: counts[k] - ideal[k])
+    for k in by_remainder[:leftover]:
+        counts[k] += 1
+
+    # Take columns from the biggest pieces to give to the empty ones
+    if u_quads >= len(weights):
+        for k in range(len(counts)):
+            if counts[k] == 0:
+                biggest = counts.index(max(counts))
+                counts[biggest] -= 1
+                counts[k] += 1
+    return counts
+
 class Union(CrossSection):
-    def __init__(self, cross_sections):
+    """
+    Join several cross sections end to end. Each cross section gets a
+    piece of the u range from 0 to 1.
+    """
+    def __init__(self, cross_sections, weights=None, u_quads=None):
+        """
+        cross_sections: the list of CrossSections to join
+
+        weights: how big of a piece of the u range each cross section
+            gets. This can be None to split the u range evenly, 'auto' to
+            let auto_weights() decide from the length and curvature of
+            each cross section, or a list with a number per cross section.
+            The numbers can't be negative and can't all be 0.
+
+        u_quads: if this is the number of quads in the u direction of the
+            mesh, the boundaries between pieces are snapped to the columns
+            of the mesh. That way every seam lands exactly on a column of
+            vertices.
+        """
         self.cross_sections = cross_sections
 
+        if weights is None:
+            weights = [1.0] * len(cross_sections)
+        elif isinstance(weights, str):
+            if weights != 'auto':
+                raise ValueError("unknown weights {}".format(weights))
+            weights = auto_weights(cross_sections)
+        if any(w < 0 for w in weights) or not sum(weights) > 0:
+            raise ValueError(
+                "weights must not be negative and must add up to more than "
+                "0, got {}".format(list(weights)))
+        self.weights = weights
+
+        if u_quads is None:
+            total = float(sum(weights))
+            sizes = [w / total for w in weights]
+            self.breaks = [0.0]
+            for size in sizes:
+                self.breaks.append(self.breaks[-1] + size)
+            self.breaks[-1] = 1.0
+        else:
+            counts = column_budget(weights, u_quads)
+            self.breaks = [0.0]
+            for count in counts:
+                column = round(self.breaks[-1] * u_quads) + count
+                self.breaks.append(column / u_quads)
+
+        # Pieces of size 0 are never used
+        self.pieces = [
+            k for k in range(len(cross_sections))
+            if self.breaks[k + 1] > self.breaks[k]]
+
+    def locate(self, u):
+        """
+        Find which cross section u lands in and where it lands in that
+        cross section's own u range.
+
+        returns (index, fraction)
+        """
+        for k in reversed(self.pieces):
+            if u >= self.breaks[k]:
+                break
+
+        start = self.breaks[k]
+        stop = self.breaks[k + 1]
+        fraction = min((u - start) / (stop - start), 1.0)
+        return k, fraction
+
     def position(self, u, v):
-        N = len(self.cross_sections)
-        section_int, section_frac = divmod(u * N, 1.0)
-        section_int = int(section_int)
+        k, fraction = self.locate(u)
+        return self.cross_sections[k].position(fraction, v)
+
+    def positions(self, us, v):
+        """
+        Hand each cross section all of its u values in one batch. When the
+        breaks are snapped to the columns of the grid, each batch is
+        evenly spaced, so the children can use their fast paths.
+        """
+        # Same as locate(), for every u at once
+        pieces = np.array(self.pieces)
+        breaks = np.array(self.breaks)
+        starts = breaks[pieces]
+        stops = breaks[pieces + 1]
+        found = np.searchsorted(starts, us, side='right') - 1
+        found = np.maximum(found, 0)
+        indices = pieces[found]
+        fractions = np.minimum(
+            (us - starts[found]) / (stops[found] - starts[found]), 1.0)
 
-        try:
-            cs = self.cross_sections[section_int]
-            return cs.position(section_frac, v)
-        except IndexError:
-            cs = self.cross_sections[-1]
-            return cs.position(1.0, v)
+        result = np.empty((len(us), 3))
+
+        for k in self.pieces:
+            mask = indices == k
+            if mask.any():
+                cs = self.cross_sections[k]
+                result[mask] = cs.positions(fractions[mask], v)
+        return result
 
 class Combine(CrossSection):
     """
@@ -131,3 +395,66 @@ class Combine(CrossSection):
     def position(self, u, v):
         points = [cs.position(u, v) for cs in self.cross_sections]
         return functools.reduce(self.op, points)
+
+class Baked(CrossSection):
+    """
+    Lookup table version of a cross section. The original is sampled on
+    a grid of (u, v) values once, then positions are found by binary
+    search and bilinear interpolation. This makes deep chains of
+    Transformed cross sections as cheap to evaluate as a table lookup.
+    """
+    def __init__(self, original_cs, u_samples=256, v_samples=64):
+        """
+        original_cs: the CrossSection to bake
+
+        u_samples, v_samples: either the number of evenly spaced intervals
+            to sample in that direction or a sorted sequence of values to
+            sample at.
+        """
+        self.us = self.make_samples(u_samples)
+        self.vs = self.make_samples(v_samples)
+
+        self.table = np.empty((len(self.vs), len(self.us), 3))
+        for j, v in enumerate(self.vs):
+            self.table[j] = original_cs.positions(self.us, v)
+
+    @classmethod
+    def make_samples(cls, samples):
+        if isinstance(samples, numbers.Integral):
+            return np.linspace(0.0, 1.0, samples + 1)
+        return np.asarray(samples, dtype=float)
+
+    @classmethod
+    def locate(cls, values, x):
+        """
+        Find the interval [values[k], values[k + 1]] that x falls in and
+        how far along the interval x is.
+
+        returns (k, t)
+        """
+        k = bisect.bisect_right(values, x) - 1
+        k = min(max(k, 0), len(values) - 2)
+        t = (x - values[k]) / (values[k + 1] - values[k])
+        return k, t
+
+    def row(self, v):
+        """
+        Interpolate a whole row of the table for this v
+        """
+        j, s = self.locate(self.vs, v)
+        return self.table[j] * (1.0 - s) + self.table[j + 1] * s
+
+    def position(self, u, v):
+        row = self.row(v)
+        i, t = self.locate(self.us, u)
+        return Vector(row[i] * (1.0 - t) + row[i + 1] * t)
+
+    def positions(self, us, v):
+        row = self.row(v)
+
+        us = np.asarray(us, dtype=float)
+        i = np.searchsorted(self.us, us, side='right') - 1
+        i = np.clip(i, 0, len(self.us) - 2)
+        t = (us - self.us[i]) / (self.us[i + 1] - self.us[i])
+        t = t[:, np.newaxis]
+        return row[i] * (1.0 - t) + row[i + 1] * t
@@ -0,0 +1,309 @@
+"""
+Long-lived generation server. Start it inside Blender so bpy and mathutils
+are available, and the interpreter and imports are only paid for once:
+
+    blender -b --python daemon.py -- --socket /tmp/pasta.sock --workers 4
+
+Then submit jobs with pasta_client.py. Each job is one line of JSON:
+
+    {
+        "shape": "SuperSeashell",
+        "params": {"coil_angle": [0.0, 20.0]},
+        "u_res": 64,
+        "v_res": 256,
+        "format": "obj",
+        "dtype": "float32",
+        "output": "/tmp/shell.obj"
+    }
+
+and the reply is one line of JSON, either
+{"ok": true, "output": ..., "vertices": ..., "cached": ..., "seconds": ...}
+or {"ok": false, "error": ...}
+"""
+import os
+import sys
+import stat
+import socket
+import json
+import time
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from mathutils import Vector
+
+import export
+import shapes
+import uv_mesh
+
+FORMATS = {
+    'obj': export.write_obj,
+    'npz': export.save_grid,
+    'quantized': export.save_quantized,
+}
+
+DTYPES = {
+    'float32': np.float32,
+    'float64': np.float64,
+}
+
+class LRUCache:
+    """
+    Thread-safe dictionary that forgets the least recently used entries
+    once the total size of its entries is more than max_size. By default
+    every entry has a size of 1, so max_size is a number of entries.
+    """
+    def __init__(self, max_size, size_of=lambda value: 1):
+        self.max_size = max_size
+        self.size_of = size_of
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.total_size -= self.size_of(self.entries.pop(key))
+            self.entries[key] = value
+            self.total_size += self.size_of(value)
+
+            # A value bigger than max_size is not kept at all
+            while self.total_size > self.max_size:
+                _, old_value = self.entries.popitem(last=False)
+                self.total_size -= self.size_of(old_value)
+
+def decode_param(default, value):
+    """
+    JSON only has lists, but some parameters are tuples of Vectors.
+    Use the structure of the default value to convert them back.
+    """
+    if isinstance(default, Vector):
+        return Vector(value)
+    elif isinstance(default, tuple):
+        return tuple(decode_param(d, x) for d, x in zip(default, value))
+    else:
+        return value
+
+class Generator:
+    """
+    Turns jobs into files. Shape graphs (the ExtrudedSurface of a shape)
+    and recently computed grids are kept in caches so repeated jobs skip
+    as much work as possible.
+
+    The grid cache is bounded by the memory the grids use (max_grid_bytes)
+    rather than by how many there are, since their size depends on the
+    resolution of each job.
+    """
+    def __init__(self, max_surfaces=64, max_grid_bytes=256 * 2**20):
+        self.surfaces = LRUCache(max_surfaces)
+        self.grids = LRUCache(max_grid_bytes, lambda grid: grid.nbytes)
+
+    def get_shape_class(self, name):
+        """
+        Look up a shape class by name. Only concrete ExtrudedShapes can
+        be generated, since every output format holds a single grid.
+        """
+        shape_class = getattr(shapes, name, None)
+        if not (
+                isinstance(shape_class, type) and
+                issubclass(shape_class, shapes.Shape)):
+            raise ValueError("unknown shape {}".format(name))
+
+        if issubclass(shape_class, shapes.MultiExtrudedShape):
+            raise ValueError(
+                "{} has several surfaces, which the server does not "
+                "support".format(name))
+
+        # Shape and ExtrudedShape themselves have no cross section
+        base = shapes.ExtrudedShape
+        is_abstract = (
+            not issubclass(shape_class, base) or
+            shape_class.make_cross_section is base.make_cross_section)
+        if is_abstract:
+            raise ValueError("{} is not a complete shape".format(name))
+        return shape_class
+
+    def make_shape(self, job):
+        shape_class = self.get_shape_class(job['shape'])
+
+        # Instantiate once with the defaults to learn the parameter types
+        defaults = shape_class(1, 1).params
+        params = {}
+        for name, value in job.get('params', {}).items():
+            if name not in defaults:
+                raise ValueError("unknown parameter {}".format(name))
+            params[name] = decode_param(defaults[name], value)
+
+        return shape_class(job['u_res'], job['v_res'], **params)
+
+    def get_surface(self, job):
+        # The surface can depend on u_res (e.g. cross_section.Union), but
+        # not on v_res
+        params = json.dumps(job.get('params', {}), sort_keys=True)
+        key = (job['shape'], params, job['u_res'])
+
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.make_shape(job).make_surface()
+            self.surfaces.put(key, surface)
+        return surface
+
+    def get_grid(self, job, dtype):
+        """
+        returns (grid, cached)
+        """
+        params = json.dumps(job.get('params', {}), sort_keys=True)
+        key = (job['shape'], params, job['u_res'], job['v_res'], dtype)
+
+        grid = self.grids.get(key)
+        if grid is not None:
+            return grid, True
+
+        surface = self.get_surface(job)
+        grid = uv_mesh.make_uv_grid(
+            job['u_res'], job['v_res'], surface, DTYPES[dtype])
+        self.grids.put(key, grid)
+        return grid, False
+
+    def run(self, job):
+        start = time.perf_counter()
+
+        output_format = job.get('format', 'obj')
+        if output_format not in FORMATS:
+            raise ValueError("unknown format {}".format(output_format))
+
+        dtype = job.get('dtype', 'float32')
+        if dtype not in DTYPES:
+            raise ValueError("unknown dtype {}".format(dtype))
+
+        grid, cached = self.get_grid(job, dtype)
+
+        # Normals of closed shapes have to wrap around the seam
+        options = {}
+        if output_format == 'quantized':
+            shape_class = self.get_shape_class(job['shape'])
+            options['cyclic_u'] = shape_class.cyclic_u
+
+        # The npz formats can add an extension, so report the file that
+        # was really written
+        output = FORMATS[output_format](job['output'], grid, **options)
+
+        return {
+            'ok': True,
+            'output': output,
+            'vertices': grid.shape[0] * grid.shape[1],
+            'cached': cached,
+            'seconds': time.perf_counter() - start,
+        }
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            job = json.loads(self.rfile.readline().decode('utf-8'))
+            reply = self.server.generator.run(job)
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+            reply = {'ok': False, 'error': error}
+
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+class JobServer(socketserver.UnixStreamServer):
+    """
+    Unix socket server that handles each connection on a fixed pool of
+    worker threads instead of starting a new thread per connection
+    """
+    def __init__(self, socket_path, workers):
+        self.generator = Generator()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        super().__init__(socket_path, JobHandler)
+
+    def server_bind(self):
+        # Only the user running the daemon may connect, since jobs write
+        # files wherever their output says. The umask closes the window
+        # between bind() and chmod()
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.server_address, 0o600)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_job, request, client_address)
+
+    def process_job(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+def script_args():
+    """
+    Blender passes its own arguments to the script. Only look at the ones
+    after --
+    """
+    if '--' in sys.argv:
+        return sys.argv[sys.argv.index('--') + 1:]
+    return sys.argv[1:]
+
+def remove_stale_socket(path):
+    """
+    Remove the socket left behind by a daemon that did not shut down
+    cleanly. Raises RuntimeError if path is something else than a socket
+    or if a daemon is still listening on it.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError("{} exists and is not a socket".format(path))
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except ConnectionRefusedError:
+        os.remove(path)
+        return
+    finally:
+        client.close()
+    raise RuntimeError("a daemon is already running on {}".format(path))
+
+def main():
+    parser = argparse.ArgumentParser(description="Pasta generation server")
+    parser.add_argument('--socket', default='/tmp/pasta.sock')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args(script_args())
+
+    try:
+        remove_stale_socket(args.socket)
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    server = JobServer(args.socket, args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+import numpy as np
+
+import uv_mesh
+
+# How many significant digits it takes to write a float of each precision
+# to text without losing information.
+SIGNIFICANT_DIGITS = {
+    np.dtype(np.float32): 9,
+    np.dtype(np.float64): 17,
+}
+
+def write_obj(filename, grid, ordering='column'):
+    """
+    Write a grid from uv_mesh.make_uv_grid() as a Wavefront OBJ file.
+    Coordinates are written with as many digits as the precision of the
+    grid needs, so a float32 grid makes a smaller file.
+
+    ordering is one of grid_order.ORDERINGS
+
+    Returns the name of the file
+    """
+    digits = SIGNIFICANT_DIGITS.get(grid.dtype, 17)
+    vertex_format = 'v {{:.{0}g}} {{:.{0}g}} {{:.{0}g}}\n'.format(digits)
+
+    mesh = uv_mesh.StructuredGrid(grid, ordering)
+
+    with open(filename, 'w') as f:
+        for x, y, z in mesh.vertices.tolist():
+            f.write(vertex_format.format(x, y, z))
+
+        # OBJ indices start at 1
+        faces = mesh.faces + 1
+        for a, b, c, d in faces.tolist():
+            f.write('f {} {} {} {}\n'.format(a, b, c, d))
+    return filename
+
+def npz_filename(filename):
+    """
+    np.savez() adds .npz to file names that don't already end with it.
+    Do the same up front so the caller knows where the file went.
+    """
+    if not filename.endswith('.npz'):
+        filename += '.npz'
+    return filename
+
+def save_grid(filename, grid, dtype=None):
+    """
+    Save a grid as a .npz file. If dtype is given, the grid is converted
+    first, e.g. np.float32 to halve the size of the file.
+
+    Returns the name of the file, with .npz added if it was missing
+    """
+    if dtype is not None:
+        grid = grid.astype(dtype)
+    filename = npz_filename(filename)
+    np.savez(filename, positions=grid)
+    return filename
+
+def load_grid(filename):
+    """
+    Load a grid saved by save_grid()
+    """
+    with np.load(filename) as data:
+        return data['positions']
+
+# Largest value of a 16-bit unsigned integer, used for quantized positions
+POSITION_STEPS = 65535
+
+# Each component of an octahedral normal gets 8 of the 16 bits
+NORMAL_STEPS = 255
+
+def raw_normals(grid, cyclic_u=False):
+    """
+    Unit vertex normals of a grid, from the cross product of the
+    derivatives in the u and v directions. The direction matches the
+    winding of the quads. Degenerate points (e.g. the tip of a cone) get
+    a zero normal.
+
+    If cyclic_u is True, the first and last columns of the grid are the
+    same seam. The u derivative then wraps around the seam instead of
+    using one-sided differences, so both columns get the same normal.
+
+    returns (normals, valid) where valid is False at degenerate points
+    """
+    if cyclic_u:
+        ring = grid[:-1]
+        du = (np.roll(ring, -1, axis=0) - np.roll(ring, 1, axis=0)) / 2.0
+        du = np.concatenate([du, du[:1]])
+    else:
+        du = np.gradient(grid, axis=0)
+    dv = np.gradient(grid, axis=1)
+    normals = np.cross(du, dv)
+
+    lengths = np.linalg.norm(normals, axis=-1, keepdims=True)
+    valid = lengths[..., 0] > 0.0
+    lengths[~valid] = 1.0
+    return normals / lengths, valid
+
+def nearest_valid(valid, axis):
+    """
+    For each point of a 2D mask, the index along axis of the nearest
+    point in the same row or column where the mask is True, and whether
+    there is one at all
+    """
+    valid = np.moveaxis(valid, axis, 1)
+    count = valid.shape[1]
+    index = np.broadcast_to(np.arange(count), valid.shape)
+
+    before = np.where(valid, index, -count)
+    before = np.maximum.accumulate(before, axis=1)
+    after = np.where(valid, index, 2 * count)
+    after = np.minimum.accumulate(after[:, ::-1], axis=1)[:, ::-1]
+
+    nearest = np.where(index - before <= after - index, before, after)
+    found = (nearest >= 0) & (nearest < count)
+    nearest = np.clip(nearest, 0, count - 1)
+    return np.moveaxis(nearest, 1, axis), np.moveaxis(found, 1, axis)
+
+def fill_normals(normals, valid):
+    """
+    Give each degenerate point the normal of the nearest valid point in
+    the v direction, or else in the u direction. At the tip of a cone
+    this is the normal of the ring next to the tip. Points that are still
+    left (only if the whole grid is degenerate) keep a zero normal.
+
+    returns (normals, valid) with valid updated
+    """
+    normals = normals.copy()
+    valid = valid.copy()
+    for axis in (1, 0):
+        missing = ~valid
+        if not missing.any():
+            break
+
+        nearest, found = nearest_valid(valid, axis)
+        source = np.take_along_axis(
+            normals, np.expand_dims(nearest, -1), axis=axis)
+        fill = missing & found
+        normals[fill] = source[fill]
+        valid |= fill
+    return normals, valid
+
+def grid_normals(grid, cyclic_u=False):
+    """
+    Unit vertex normals of a grid, see raw_normals(). Degenerate points
+    get a normal from their neighbors, see fill_normals()
+    """
+    normals, valid = raw_normals(grid, cyclic_u)
+    normals, _ = fill_normals(normals, valid)
+    return normals
+
+def sign_not_zero(x):
+    return np.where(x >= 0.0, 1.0, -1.0)
+
+def oct_encode(normals):
+    """
+    Octahedral encoding: project unit vectors onto the octahedron
+    |x| + |y| + |z| = 1, fold the lower half over the upper half and
+    store the resulting (x, y) square with 8 bits per component.
+
+    Returns a uint16 array with one value per normal
+    """
+    n = normals.reshape(-1, 3)
+    l1 = np.abs(n).sum(axis=1)
+    l1[l1 == 0.0] = 1.0
+
+    x = n[:, 0] / l1
+    y = n[:, 1] / l1
+    lower = n[:, 2] < 0.0
+    x, y = (
+        np.where(lower, (1.0 - np.abs(y)) * sign_not_zero(x), x),
+        np.where(lower, (1.0 - np.abs(x)) * sign_not_zero(y), y))
+
+    qx = np.round((x * 0.5 + 0.5) * NORMAL_STEPS).astype(np.uint16)
+    qy = np.round((y * 0.5 + 0.5) * NORMAL_STEPS).astype(np.uint16)
+    return ((qx << 8) | qy).reshape(normals.shape[:-1])
+
+def oct_decode(encoded):
+    """
+    Inverse of oct_encode(). Returns unit normals as float32
+    """
+    flat = encoded.reshape(-1)
+    x = (flat >> 8).astype(np.float32) / NORMAL_STEPS * 2.0 - 1.0
+    y = (flat & 0xff).astype(np.float32) / NORMAL_STEPS * 2.0 - 1.0
+    z = 1.0 - np.abs(x) - np.abs(y)
+
+    lower = z < 0.0
+    x, y = (
+        np.where(lower, (1.0 - np.abs(y)) * sign_not_zero(x), x),
+        np.where(lower, (1.0 - np.abs(x)) * sign_not_zero(y), y))
+
+    normals = np.stack([x, y, z], axis=1)
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals.astype(np.float32).reshape(encoded.shape + (3,))
+
+def quantize_positions(grid):
+    """
+    Store each coordinate as a 16-bit integer relative to the bounding
+    box of the grid.
+
+    returns (quantized, lo, hi)
+    """
+    lo = grid.reshape(-1, 3).min(axis=0).astype(np.float64)
+    hi = grid.reshape(-1, 3).max(axis=0).astype(np.float64)
+    size = hi - lo
+    size[size == 0.0] = 1.0
+
+    quantized = np.round((grid - lo) / size * POSITION_STEPS)
+    return quantized.astype(np.uint16), lo, hi
+
+def dequantize_positions(quantized, lo, hi):
+    """
+    Inverse of quantize_positions(). Returns float32 positions
+    """
+    size = hi - lo
+    size[size == 0.0] = 1.0
+    grid = lo + quantized.astype(np.float64) / POSITION_STEPS * size
+    return grid.astype(np.float32)
+
+def save_quantized(filename, grid, cyclic_u=False):
+    """
+    Save a grid in a compact form: 16-bit positions relative to the
+    bounding box plus 16-bit octahedral normals. The faces are not
+    stored since they follow from the size of the grid.
+
+    Pass the cyclic_u of the shape so closed surfaces get smooth normals
+    across the seam, see raw_normals().
+
+    Returns the name of the file, with .npz added if it was missing
+    """
+    quantized, lo, hi = quantize_positions(grid)
+    normals = oct_encode(grid_normals(grid, cyclic_u))
+    filename = npz_filename(filename)
+    np.savez(filename, positions=quantized, lo=lo, hi=hi, normals=normals)
+    return filename
+
+def load_quantized(filename):
+    """
+    Load a file made by save_quantized()
+
+    returns (grid, normals), both float32 arrays of shape
+    (u_quads + 1, v_quads + 1, 3)
+    """
+    with np.load(filename) as data:
+        grid = dequantize_positions(data['positions'], data['lo'], data['hi'])
+        normals = oct_decode(data['normals'])
+    return grid, normals
+
+def load_quantized_mesh(name, filename, ordering='column'):
+    """
+    Load a file made by save_quantized() straight into a new Blender mesh,
+    with the stored normals as custom split normals.
+
+    Returns the new mesh
+    """
+    grid, normals = load_quantized(filename)
+    structured_grid = uv_mesh.StructuredGrid(grid, ordering)
+    mesh = structured_grid.to_mesh(name)
+
+    vertex_order, _ = structured_grid.topology
+    mesh.use_auto_smooth = True
+    mesh.normals_split_custom_set_from_vertices(
+        normals.reshape(-1, 3)[vertex_order])
+    return mesh
+
+def quantization_report(grid, cyclic_u=False):
+    """
+    How much space quantization saves for this grid and how much accuracy
+    it costs.
+
+    The position error is at most half a quantization step of the largest
+    side of the bounding box, plus the float32 rounding of the decoded
+    positions (position_tolerance). Normals with 8 bits per octahedral
+    component are typically within about a degree.
+
+    degenerate_normals counts the points that had no normal of their own
+    and were given one by fill_normals(). missing_normals counts the
+    points that are still without one. They are stored as +Z.
+
+    Returns a dictionary
+    """
+    quantized, lo, hi = quantize_positions(grid)
+    normals, valid = raw_normals(grid, cyclic_u)
+    normals, filled = fill_normals(normals, valid)
+    encoded = oct_encode(normals)
+
+    positions = dequantize_positions(quantized, lo, hi)
+    position_error = float(np.abs(positions - grid).max())
+    half_step = (hi - lo).max() / POSITION_STEPS / 2.0
+    rounding = np.finfo(np.float32).eps * np.abs(grid).max()
+    position_tolerance = float(half_step + rounding)
+
+    # Points without any normal can't be compared
+    cosines = np.sum(oct_decode(encoded) * normals, axis=-1)[filled]
+    angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+    normal_error = float(angles.max(initial=0.0))
+
+    # Full precision: the grid as it is plus float32 normals
+    raw_bytes = grid.nbytes + normals.astype(np.float32).nbytes
+    quantized_bytes = quantized.nbytes + encoded.nbytes + lo.nbytes + hi.nbytes
+
+    return {
+        'raw_bytes': raw_bytes,
+        'quantized_bytes': quantized_bytes,
+        'ratio': raw_bytes / quantized_bytes,
+        'max_position_error': position_error,
+        'position_tolerance': position_tolerance,
+        'within_tolerance': position_error <= position_tolerance,
+        'max_normal_error_degrees': normal_error,
+        'degenerate_normals': int(np.count_nonzero(~valid)),
+        'missing_normals': int(np.count_nonzero(~filled)),
+    }
@@ -1,3 +1,4 @@
+import numpy as np
 from mathutils import Vector
 
 class ExtrudedSurface:
@@ -25,3 +26,66 @@ class ExtrudedSurface:
 
         # Add the two vectors to get a point on the extruded surface
         return cs_euclidean + path_pos
+
+    def evaluate(self, us, vs, out):
+        """
+        Batched version of position(). Evaluate the surface at every
+        combination of us and vs and write the result into out, an array
+        of shape (len(us), len(vs), 3).
+
+        The math is always done in double precision, out only controls
+        how the result is stored. This way a float32 buffer is only
+        rounded once per coordinate.
+        """
+        frames = self.path.sample_frames(vs)
+        return extrude(self.cross_section, us, vs, frames, out)
+
+class MultiExtrudedSurface:
+    """
+    Extrude several cross sections along the same path, for example
+    nested tubes or the inner and outer walls of a shell. The path and
+    its frames are only evaluated once per v for all of the surfaces.
+    """
+    def __init__(self, cross_sections, path):
+        self.cross_sections = cross_sections
+        self.path = path
+
+    @property
+    def surfaces(self):
+        """
+        The individual surfaces, e.g. for evaluating a single point
+        """
+        return [ExtrudedSurface(cs, self.path) for cs in self.cross_sections]
+
+    def evaluate(self, us_list, vs, outs):
+        """
+        Batched evaluation of every surface. us_list and outs have one
+        entry per cross section, so each surface can have its own u
+        resolution. See ExtrudedSurface.evaluate()
+        """
+        frames = self.path.sample_frames(vs)
+        for cs, us, out in zip(self.cross_sections, us_list, outs):
+            extrude(cs, us, vs, frames, out)
+        return outs
+
+def extrude(cross_section, us, vs, frames, out):
+    """
+    Evaluate the cross section at every combination of us and vs and
+    express it in the frames (P, T, N, B) from Path.sample_frames(vs).
+    The result is written into out, an array of shape
+    (len(us), len(vs), 3)
+    """
+    P, T, N, B = frames
+
+    cs = np.empty((len(us), len(vs), 3))
+    for j, v in enumerate(vs):
+        cs[:, j] = cross_section.positions(us, v)
+
+    # Express the cross sections in the frames of the path for the
+    # whole block at once. (len(vs), 3) frames broadcast against
+    # (len(us), len(vs), 1) coordinates
+    x = cs[:, :, 0:1]
+    y = cs[:, :, 1:2]
+    z = cs[:, :, 2:3]
+    out[...] = N * x + B * y + T * z + P
+    return out
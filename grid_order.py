@@ -0,0 +1,156 @@
+import functools
+from collections import deque
+
+import numpy as np
+
+# Number of columns of quads in each strip of the 'strips' ordering. Each
+# row of a strip reuses the width + 1 vertices of the previous row, so two
+# rows have to fit in the post-transform cache: 2 * (14 + 1) <= 32
+STRIP_WIDTH = 14
+
+# Typical size of a GPU post-transform vertex cache
+CACHE_SIZE = 32
+
+ORDERINGS = ('column', 'strips', 'morton')
+
+def face_cells(u_quads, v_quads, ordering='column', strip_width=STRIP_WIDTH):
+    """
+    List the quads of a UV grid as (i, j) pairs in the given order:
+
+    'column': i outer, j inner, the order make_uv_mesh() has always used
+    'strips': the grid is cut into strips strip_width quads wide in the u
+        direction, and each strip is walked row by row along v
+    'morton': Z-order curve over (i, j), good at any cache size
+
+    Returns an int32 array of shape (u_quads * v_quads, 2)
+    """
+    i, j = np.meshgrid(
+        np.arange(u_quads, dtype=np.int32),
+        np.arange(v_quads, dtype=np.int32),
+        indexing='ij')
+    i = i.reshape(-1)
+    j = j.reshape(-1)
+
+    if ordering == 'column':
+        order = np.arange(len(i))
+    elif ordering == 'strips':
+        # np.lexsort sorts by the last key first
+        order = np.lexsort((i, j, i // strip_width))
+    elif ordering == 'morton':
+        order = np.argsort(morton_codes(i, j), kind='stable')
+    else:
+        raise ValueError("unknown ordering {}".format(ordering))
+
+    return np.stack([i[order], j[order]], axis=1)
+
+def morton_codes(i, j):
+    """
+    Interleave the bits of i and j to get the index of each cell along a
+    Z-order curve
+    """
+    # The codes need twice as many bits as the indices
+    i = i.astype(np.int64)
+    j = j.astype(np.int64)
+    codes = np.zeros(len(i), dtype=np.int64)
+    bits = max(int(i.max(initial=0)), int(j.max(initial=0))).bit_length()
+    for bit in range(bits):
+        codes |= ((i >> bit) & 1) << (2 * bit)
+        codes |= ((j >> bit) & 1) << (2 * bit + 1)
+    return codes
+
+def grid_faces(u_quads, v_quads, ordering='column', strip_width=STRIP_WIDTH):
+    """
+    Vertex indices of the quads of a UV grid, in the given face order.
+    Vertex (i, j) has index i * (v_quads + 1) + j, which is the order of
+    grid.reshape(-1, 3) for a grid from uv_mesh.make_uv_grid()
+
+    Returns an int32 array of shape (u_quads * v_quads, 4), the index
+    type Blender uses
+    """
+    cells = face_cells(u_quads, v_quads, ordering, strip_width)
+    v_verts = v_quads + 1
+    first = cells[:, 0] * v_verts + cells[:, 1]
+    return np.stack([
+        first,
+        first + v_verts,
+        first + v_verts + 1,
+        first + 1
+    ], axis=1)
+
+def reorder_vertices(faces):
+    """
+    Renumber the vertices in the order the faces first use them, so
+    vertices that are used together are stored together.
+
+    returns (vertex_order, new_faces) where vertex_order[k] is the old
+    index of new vertex k
+    """
+    flat = faces.reshape(-1)
+    vertices, first_use = np.unique(flat, return_index=True)
+    vertex_order = vertices[np.argsort(first_use)]
+
+    new_index = np.empty(flat.max() + 1, dtype=flat.dtype)
+    new_index[vertex_order] = np.arange(len(vertex_order))
+    return vertex_order, new_index[faces]
+
+# The index arrays of a large grid take hundreds of MB, so only keep the
+# topology of a few grid sizes
+@functools.lru_cache(maxsize=4)
+def ordered_mesh(u_quads, v_quads, ordering='column'):
+    """
+    Vertex and face order for a UV grid mesh.
+
+    returns (vertex_order, faces). vertex_order lists grid vertex indices
+    in the order they should be stored, and faces indexes into that
+    reordered vertex list. 'column' keeps the original layout where the
+    vertices are stored in grid order.
+
+    The topology only depends on the grid size, so the results are cached
+    and shared. They are read-only, copy them before modifying.
+    """
+    faces = grid_faces(u_quads, v_quads, ordering)
+    if ordering == 'column':
+        vertex_count = (u_quads + 1) * (v_quads + 1)
+        vertex_order = np.arange(vertex_count, dtype=np.int32)
+    else:
+        vertex_order, faces = reorder_vertices(faces)
+
+    vertex_order.setflags(write=False)
+    faces.setflags(write=False)
+    return vertex_order, faces
+
+def acmr(faces, cache_size=CACHE_SIZE):
+    """
+    Average cache miss ratio: simulate a FIFO post-transform vertex cache
+    and count how many vertices have to be transformed per triangle. Each
+    quad is drawn as two triangles (a, b, c) and (a, c, d).
+
+    A regular grid can get close to 0.5, the worst case is 3.0
+    """
+    cache = deque()
+    cached = set()
+    misses = 0
+
+    for a, b, c, d in faces.tolist():
+        for vertex in (a, b, c, a, c, d):
+            if vertex in cached:
+                continue
+
+            misses += 1
+            cache.append(vertex)
+            cached.add(vertex)
+            if len(cache) > cache_size:
+                cached.discard(cache.popleft())
+
+    return misses / (2.0 * len(faces))
+
+def acmr_report(u_quads, v_quads, cache_size=CACHE_SIZE):
+    """
+    ACMR of every ordering for a grid of this size.
+
+    returns a dictionary of ordering -> ACMR
+    """
+    return {
+        ordering: acmr(ordered_mesh(u_quads, v_quads, ordering)[1], cache_size)
+        for ordering in ORDERINGS
+    }
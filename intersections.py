@@ -0,0 +1,488 @@
+import numpy as np
+
+class SelfIntersectionError(ValueError):
+    """
+    Raised when a generated surface passes through itself
+    """
+    def __init__(self, name, pairs):
+        self.name = name
+        self.pairs = pairs
+        message = "{} has {} self-intersecting face pairs".format(
+            name, len(pairs))
+        super().__init__(message)
+
+# Maximum number of faces in a leaf of a GridBVH
+LEAF_FACES = 16
+
+def row_frame(direction):
+    """
+    Orthonormal axes (as the rows of a 3x3 array) with the first axis
+    along direction, or the coordinate axes if direction is zero
+    """
+    length = np.linalg.norm(direction)
+    if length == 0.0:
+        return np.eye(3)
+
+    tangent = direction / length
+    helper = np.eye(3)[np.argmin(np.abs(tangent))]
+    side = np.cross(tangent, helper)
+    side /= np.linalg.norm(side)
+    return np.array([tangent, side, np.cross(tangent, side)])
+
+class GridBVHNode:
+    """
+    A rectangle of faces [i0, i1) x [j0, j1) of the UV grid with two
+    bounding volumes around all of them: an axis-aligned box (lo, hi)
+    and a box (box_lo, box_hi) along axes that follow the path at these
+    rows. common holds the labels of the vertex positions that every one
+    of the faces has as a corner.
+    """
+    def __init__(
+            self, i0, i1, j0, j1, lo, hi, axes, box_lo, box_hi, common,
+            children=None):
+        self.i0 = i0
+        self.i1 = i1
+        self.j0 = j0
+        self.j1 = j1
+        self.lo = lo
+        self.hi = hi
+        self.axes = axes
+        self.box_lo = box_lo
+        self.box_hi = box_hi
+        self.common = common
+        self.children = children
+
+        # The 8 corners of the oriented box in world space
+        bounds = np.stack([box_lo, box_hi])
+        corners = np.array([
+            [bounds[x, 0], bounds[y, 1], bounds[z, 2]]
+            for x in (0, 1) for y in (0, 1) for z in (0, 1)])
+        self.box_corners = corners.dot(axes)
+
+    @property
+    def count(self):
+        return (self.i1 - self.i0) * (self.j1 - self.j0)
+
+    def separates(self, other):
+        """
+        Check if one of the axes of this node's box separates the two
+        boxes
+        """
+        projected = other.box_corners.dot(self.axes.T)
+        return (
+            np.any(projected.min(axis=0) > self.box_hi) or
+            np.any(projected.max(axis=0) < self.box_lo))
+
+    def overlaps(self, other):
+        if np.any(self.lo > other.hi) or np.any(other.lo > self.hi):
+            return False
+        return not (self.separates(other) or other.separates(self))
+
+class GridBVH:
+    """
+    Bounding volume hierarchy over the faces of a UV grid. Neighboring
+    faces in the grid are neighbors in space too, so the hierarchy is
+    built by splitting the grid of faces in half, with no sorting
+    needed: first into rows, then each row into arcs of LEAF_FACES faces.
+
+    Near the tip of a tapered shape the quads are much longer along the
+    path than the ring is wide, so the axis-aligned boxes of a whole
+    ring overlap each other. Each node also gets a box along the
+    direction of the path at its rows, which keeps the opposite sides of
+    a thin ring apart, and pairs of faces in the leaves are also compared
+    along the axes of each face. Faces that meet in one point (like the
+    fan at the tip) are neighbors, and groups of them are skipped without
+    looking at each pair.
+    """
+    def __init__(self, grid):
+        """
+        grid: grid from uv_mesh.make_uv_grid()
+        """
+        self.grid = grid
+        self.lo, self.hi = face_bounds(grid)
+        self.labels = position_labels(grid)
+        self.corners = np.stack([
+            grid[:-1, :-1], grid[1:, :-1], grid[1:, 1:], grid[:-1, 1:]
+        ], axis=2)
+        self.face_axes = face_frames(grid)
+        along = np.einsum('uvxj,uvcj->uvcx', self.face_axes, self.corners)
+        self.face_lo = along.min(axis=2)
+        self.face_hi = along.max(axis=2)
+
+        # The path direction at each row, from the centers of the rings
+        self.centers = grid.mean(axis=0)
+
+        u_quads, v_quads, _ = self.lo.shape
+        self.root = self.build(0, u_quads, 0, v_quads)
+
+    def frame_bounds(self, i0, i1, j0, j1):
+        """
+        Axes along the path for rows j0 to j1 and the extent of the
+        faces' corners along them
+        """
+        axes = row_frame(self.centers[j1] - self.centers[j0])
+        points = self.grid[i0:i1 + 1, j0:j1 + 1].reshape(-1, 3)
+        projected = points.dot(axes.T)
+        return axes, projected.min(axis=0), projected.max(axis=0)
+
+    def build(self, i0, i1, j0, j1):
+        axes, box_lo, box_hi = self.frame_bounds(i0, i1, j0, j1)
+
+        if j1 - j0 <= 1 and i1 - i0 <= LEAF_FACES:
+            lo = self.lo[i0:i1, j0:j1].reshape(-1, 3).min(axis=0)
+            hi = self.hi[i0:i1, j0:j1].reshape(-1, 3).max(axis=0)
+            faces, _, _ = self.leaf_faces_range(i0, i1, j0, j1)
+            return GridBVHNode(
+                i0, i1, j0, j1, lo, hi, axes, box_lo, box_hi,
+                common_labels(quad_corners(self.labels, faces)))
+
+        if j1 - j0 > 1:
+            mid = (j0 + j1) // 2
+            children = (
+                self.build(i0, i1, j0, mid), self.build(i0, i1, mid, j1))
+        else:
+            mid = (i0 + i1) // 2
+            children = (
+                self.build(i0, mid, j0, j1), self.build(mid, i1, j0, j1))
+
+        lo = np.minimum(children[0].lo, children[1].lo)
+        hi = np.maximum(children[0].hi, children[1].hi)
+        common = children[0].common & children[1].common
+        return GridBVHNode(
+            i0, i1, j0, j1, lo, hi, axes, box_lo, box_hi, common, children)
+
+    def candidate_pairs(self):
+        """
+        Find each pair of faces whose bounding boxes overlap exactly
+        once. Every pair of faces is below exactly one (node, node) pair
+        that the traversal visits, so no bookkeeping of seen pairs is
+        needed.
+
+        returns (faces_a, faces_b), two (n, 2) arrays of (i, j) indices
+        """
+        found_a = [np.empty((0, 2), dtype=int)]
+        found_b = [np.empty((0, 2), dtype=int)]
+        work = [(self.root, self.root)]
+        while work:
+            a, b = work.pop()
+
+            # Every face of a touches every face of b
+            if a.common & b.common:
+                continue
+
+            if a is b:
+                if a.children is None:
+                    pairs = self.leaf_pairs(a, a)
+                    found_a.append(pairs[0])
+                    found_b.append(pairs[1])
+                else:
+                    left, right = a.children
+                    work += [(left, left), (right, right), (left, right)]
+                continue
+
+            if not a.overlaps(b):
+                continue
+
+            if a.children is None and b.children is None:
+                pairs = self.leaf_pairs(a, b)
+                found_a.append(pairs[0])
+                found_b.append(pairs[1])
+            elif b.children is None or (
+                    a.children is not None and a.count >= b.count):
+                work += [(child, b) for child in a.children]
+            else:
+                work += [(a, child) for child in b.children]
+
+        return np.concatenate(found_a), np.concatenate(found_b)
+
+    def leaf_faces_range(self, i0, i1, j0, j1):
+        i, j = np.meshgrid(
+            np.arange(i0, i1), np.arange(j0, j1), indexing='ij')
+        faces = np.stack([i.reshape(-1), j.reshape(-1)], axis=1)
+        lo = self.lo[i0:i1, j0:j1].reshape(-1, 3)
+        hi = self.hi[i0:i1, j0:j1].reshape(-1, 3)
+        return faces, lo, hi
+
+    def leaf_faces(self, node):
+        return self.leaf_faces_range(node.i0, node.i1, node.j0, node.j1)
+
+    def leaf_pairs(self, a, b):
+        """
+        Compare every face in leaf a against every face in leaf b at
+        once: first their axis-aligned bounding boxes, then along the
+        axes of each face. The second test separates the long, thin
+        quads that fan out from the tip of a tapered shape.
+
+        returns (faces_a, faces_b) of the overlapping pairs
+        """
+        faces_a, lo_a, hi_a = self.leaf_faces(a)
+        faces_b, lo_b, hi_b = self.leaf_faces(b)
+
+        overlap = np.logical_not(
+            np.any(lo_a[:, np.newaxis] > hi_b[np.newaxis], axis=2) |
+            np.any(lo_b[np.newaxis] > hi_a[:, np.newaxis], axis=2))
+
+        # Within a single leaf, only look at each pair once
+        if a is b:
+            overlap = np.triu(overlap, k=1)
+
+        k, l = np.nonzero(overlap)
+        faces_a = faces_a[k]
+        faces_b = faces_b[l]
+        keep = ~(
+            self.separated_along(faces_a, faces_b) |
+            self.separated_along(faces_b, faces_a))
+        return faces_a[keep], faces_b[keep]
+
+    def separated_along(self, faces, other_faces):
+        """
+        For each pair of faces, check if one of the axes of the first
+        face (see face_frames()) separates the two
+        """
+        i, j = faces[:, 0], faces[:, 1]
+        k, l = other_faces[:, 0], other_faces[:, 1]
+        other = np.einsum(
+            'nxj,ncj->ncx', self.face_axes[i, j], self.corners[k, l])
+        return np.any(
+            (other.min(axis=1) > self.face_hi[i, j]) |
+            (other.max(axis=1) < self.face_lo[i, j]), axis=1)
+
+def face_frames(grid):
+    """
+    Orthonormal axes for each quad: along the v direction, along the u
+    direction and the normal. Degenerate quads get the coordinate axes.
+
+    returns an array of shape (u_quads, v_quads, 3, 3), one axis per row
+    """
+    a = grid[:-1, :-1]
+    b = grid[1:, :-1]
+    c = grid[1:, 1:]
+    d = grid[:-1, 1:]
+    along_v = c + d - a - b
+    along_u = b + c - a - d
+    normal = np.cross(along_u, along_v)
+
+    def normalize(vectors):
+        lengths = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        valid = lengths[..., 0] > 0.0
+        lengths[~valid] = 1.0
+        return vectors / lengths, valid
+
+    along_v, valid_v = normalize(along_v)
+    normal, valid_n = normalize(normal)
+    axes = np.stack([along_v, np.cross(normal, along_v), normal], axis=-2)
+    axes[~(valid_v & valid_n)] = np.eye(3)
+    return axes
+
+def face_bounds(grid):
+    """
+    Axis-aligned bounding box of every quad in the grid.
+
+    returns (lo, hi), each of shape (u_quads, v_quads, 3)
+    """
+    corners = np.stack([
+        grid[:-1, :-1],
+        grid[1:, :-1],
+        grid[1:, 1:],
+        grid[:-1, 1:]
+    ])
+    return corners.min(axis=0), corners.max(axis=0)
+
+# Corners of the two triangles of a quad (a, b, c, d), split the same way
+# Blender triangulates a quad face
+QUAD_TRIANGLES = ((0, 1, 2), (0, 2, 3))
+
+# Offsets of the corners a, b, c, d of quad (i, j) in the grid
+QUAD_CORNERS = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+def quad_corners(values, faces):
+    """
+    Look up the corners a, b, c, d of each quad in an array with one
+    value per grid vertex, e.g. the grid itself.
+
+    returns an array of shape (len(faces), 4) + values.shape[2:]
+    """
+    i = faces[:, 0]
+    j = faces[:, 1]
+    return np.stack(
+        [values[i + di, j + dj] for di, dj in QUAD_CORNERS], axis=1)
+
+def common_labels(corner_labels):
+    """
+    The set of labels that appear among the corners of every face
+
+    corner_labels: (n, 4) array from quad_corners()
+    """
+    common = set(corner_labels[0].tolist())
+    for labels in corner_labels[1:]:
+        common &= set(labels.tolist())
+    return frozenset(common)
+
+def position_labels(grid):
+    """
+    Number the distinct vertex positions of the grid, so vertices that
+    are in exactly the same place (e.g. the tip of a cone or the seam of
+    a closed surface) get the same label
+    """
+    _, labels = np.unique(
+        grid.reshape(-1, 3), axis=0, return_inverse=True)
+    return labels.reshape(grid.shape[:2])
+
+def are_neighbors(faces_a, faces_b, u_quads, v_quads, cyclic_u, cyclic_v):
+    """
+    Two faces are neighbors in the UV grid if they share at least a vertex.
+    Neighbors always touch, so they are not counted as intersections.
+
+    If the surface is closed in the u (or v) direction, the first and last
+    columns (or rows) of quads are neighbors too.
+
+    faces_a and faces_b are (n, 2) arrays, returns an array of n bools
+    """
+    def grid_distance(a, b, count, cyclic):
+        distance = np.abs(a - b)
+        if cyclic:
+            distance = np.minimum(distance, count - distance)
+        return distance
+
+    du = grid_distance(faces_a[:, 0], faces_b[:, 0], u_quads, cyclic_u)
+    dv = grid_distance(faces_a[:, 1], faces_b[:, 1], v_quads, cyclic_v)
+    return (du <= 1) & (dv <= 1)
+
+def share_position(labels, faces_a, faces_b):
+    """
+    Faces that have a corner in the same place touch there, like all the
+    faces around the tip of a cone, so they are neighbors too.
+
+    returns an array of one bool per pair
+    """
+    corners_a = quad_corners(labels, faces_a)
+    corners_b = quad_corners(labels, faces_b)
+    same = corners_a[:, :, np.newaxis] == corners_b[:, np.newaxis, :]
+    return same.any(axis=(1, 2))
+
+def plane_separates(tri_a, tri_b):
+    """
+    Check if tri_b is strictly on one side of the plane of tri_a. Then
+    the two triangles can't cross, so this rejects most pairs of faces
+    before the edge tests, like the sides of a thin tube whose bounding
+    boxes all overlap.
+
+    tri_a, tri_b: (n, 3, 3) arrays of triangles
+    """
+    normal = np.cross(tri_a[:, 1] - tri_a[:, 0], tri_a[:, 2] - tri_a[:, 0])
+    distance = np.einsum(
+        'nj,nkj->nk', normal, tri_b - tri_a[:, np.newaxis, 0])
+    return np.all(distance > 0.0, axis=1) | np.all(distance < 0.0, axis=1)
+
+def segments_cross_triangles(start, end, triangle, epsilon=1e-6):
+    """
+    Check if each line segment start -> end passes through the matching
+    triangle, with the Moller-Trumbore ray/triangle test. This is the
+    same test as mathutils.geometry.intersect_ray_tri(), for every
+    segment at once.
+
+    Hits within epsilon of either end of the segment are ignored so
+    triangles that merely touch at a vertex are not reported.
+
+    start, end: (n, 3) arrays, triangle: (n, 3, 3) array
+    """
+    direction = end - start
+    length = np.linalg.norm(direction, axis=1)
+    nonzero = length > 0.0
+    length[~nonzero] = 1.0
+    unit = direction / length[:, np.newaxis]
+
+    a = triangle[:, 0]
+    edge1 = triangle[:, 1] - a
+    edge2 = triangle[:, 2] - a
+    p = np.cross(unit, edge2)
+    det = np.einsum('nj,nj->n', edge1, p)
+    # Parallel to the plane of the triangle
+    nonzero &= np.abs(det) >= 1e-6
+    det[~nonzero] = 1.0
+
+    offset = start - a
+    q = np.cross(offset, edge1)
+    bary_u = np.einsum('nj,nj->n', offset, p) / det
+    bary_v = np.einsum('nj,nj->n', unit, q) / det
+    inside = (bary_u >= 0.0) & (bary_v >= 0.0) & (bary_u + bary_v <= 1.0)
+
+    # Distance along the segment as a fraction of its length
+    t = np.einsum('nj,nj->n', edge2, q) / det / length
+    return nonzero & inside & (epsilon < t) & (t < 1.0 - epsilon)
+
+def triangles_intersect(tri_a, tri_b):
+    """
+    Two (non-coplanar) triangles intersect exactly when an edge of one
+    passes through the other
+
+    tri_a, tri_b: (n, 3, 3) arrays, returns an array of n bools
+    """
+    result = np.zeros(len(tri_a), dtype=bool)
+    for first, second in ((tri_a, tri_b), (tri_b, tri_a)):
+        for k in range(3):
+            start = first[:, k]
+            end = first[:, (k + 1) % 3]
+            result |= segments_cross_triangles(start, end, second)
+    return result
+
+def quads_intersect(grid, faces_a, faces_b):
+    """
+    Exact test for (n, 2) arrays of quad indices, returns n bools
+    """
+    corners_a = quad_corners(grid, faces_a)
+    corners_b = quad_corners(grid, faces_b)
+
+    result = np.zeros(len(faces_a), dtype=bool)
+    for triangle_a in QUAD_TRIANGLES:
+        for triangle_b in QUAD_TRIANGLES:
+            tri_a = corners_a[:, triangle_a]
+            tri_b = corners_b[:, triangle_b]
+
+            # Only run the edge tests when no plane separates the pair
+            test = ~(plane_separates(tri_a, tri_b) |
+                plane_separates(tri_b, tri_a))
+            test &= ~result
+            result[test] = triangles_intersect(tri_a[test], tri_b[test])
+    return result
+
+# Candidate pairs are tested in chunks of this many to bound the memory
+# of the temporary arrays
+PAIR_CHUNK = 65536
+
+def find_self_intersections(grid, cyclic_u=False, cyclic_v=False):
+    """
+    Find pairs of quads in a grid from uv_mesh.make_uv_grid() that pass
+    through each other.
+
+    The faces are put in a GridBVH, then only faces that have overlapping
+    bounding boxes and are not neighbors (in the UV grid or by sharing a
+    corner position) get the exact triangle test. All of the tests run on
+    arrays of pairs at once.
+
+    returns a sorted list of ((i, j), (k, l)) quad index pairs
+    """
+    u_verts, v_verts, _ = grid.shape
+    u_quads = u_verts - 1
+    v_quads = v_verts - 1
+
+    bvh = GridBVH(grid)
+    faces_a, faces_b = bvh.candidate_pairs()
+    labels = bvh.labels
+
+    pairs = []
+    for start in range(0, len(faces_a), PAIR_CHUNK):
+        chunk_a = faces_a[start:start + PAIR_CHUNK]
+        chunk_b = faces_b[start:start + PAIR_CHUNK]
+
+        far = ~are_neighbors(
+            chunk_a, chunk_b, u_quads, v_quads, cyclic_u, cyclic_v)
+        far[far] = ~share_position(labels, chunk_a[far], chunk_b[far])
+        chunk_a = chunk_a[far]
+        chunk_b = chunk_b[far]
+
+        hit = quads_intersect(grid, chunk_a, chunk_b)
+        hits = zip(chunk_a[hit].tolist(), chunk_b[hit].tolist())
+        for face_a, face_b in hits:
+            pairs.append(tuple(sorted((tuple(face_a), tuple(face_b)))))
+    return sorted(pairs)
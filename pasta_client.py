@@ -0,0 +1,55 @@
+"""
+Tiny client for daemon.py. This only uses the standard library so it
+starts quickly outside of Blender:
+
+    python pasta_client.py SuperSeashell /tmp/shell.obj --u-res 64
+        --v-res 256 --params '{"coil_angle": [0.0, 20.0]}'
+"""
+import os
+import sys
+import json
+import socket
+import argparse
+
+def submit(job, socket_path='/tmp/pasta.sock'):
+    """
+    Send a job to the server and wait for the reply
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as stream:
+            stream.write((json.dumps(job) + '\n').encode('utf-8'))
+            stream.flush()
+            return json.loads(stream.readline().decode('utf-8'))
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit a pasta job")
+    parser.add_argument('shape', help="shape class name, e.g. SuperSeashell")
+    parser.add_argument('output', help="file to write the mesh to")
+    parser.add_argument('--params', default='{}', help="JSON parameters")
+    parser.add_argument('--u-res', type=int, default=32)
+    parser.add_argument('--v-res', type=int, default=128)
+    parser.add_argument(
+        '--format', default='obj', choices=['obj', 'npz', 'quantized'])
+    parser.add_argument(
+        '--dtype', default='float32', choices=['float32', 'float64'])
+    parser.add_argument('--socket', default='/tmp/pasta.sock')
+    args = parser.parse_args()
+
+    job = {
+        'shape': args.shape,
+        'params': json.loads(args.params),
+        'u_res': args.u_res,
+        'v_res': args.v_res,
+        'format': args.format,
+        'dtype': args.dtype,
+        # The server has its own working directory
+        'output': os.path.abspath(args.output),
+    }
+    reply = submit(job, args.socket)
+    print(json.dumps(reply))
+    if not reply['ok']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import math
+import bisect
+import numbers
 import util
 
+import numpy as np
 from mathutils import Vector
 from mathutils import Matrix
 
@@ -46,6 +49,23 @@ class Path:
         B = self.binormal(v)
         return (T, N, B)
 
+    def sample_frames(self, vs):
+        """
+        Batched version of position() and frenet_frame() for an array
+        of v values.
+
+        Returns a tuple (P, T, N, B) of float64 arrays with shape
+        (len(vs), 3). Subclasses can override this with something faster
+        """
+        P = np.empty((len(vs), 3))
+        T = np.empty((len(vs), 3))
+        N = np.empty((len(vs), 3))
+        B = np.empty((len(vs), 3))
+        for k, v in enumerate(vs):
+            P[k] = self.position(v)
+            T[k], N[k], B[k] = self.frenet_frame(v)
+        return (P, T, N, B)
+
 class Line(Path):
     def __init__(self, start, end):
         self.start = start
@@ -169,17 +189,62 @@ class Helix(Path):
         N.normalize()
         return N
 
+    def sample_frames(self, vs):
+        """
+        Helices are usually sampled at evenly spaced v values, which means
+        evenly spaced angles. In that case, use util.rotation_samples()
+        to avoid calling cos/sin for every sample. The formulas are the
+        same as in position(), tangent() and normal() above.
+
+        make_uv_grid() samples the path in blocks of uv_mesh.BLOCK_ROWS
+        rows, which is below util.DIRECT_SAMPLES, so there
+        rotation_samples() simply calls cos/sin. The table only kicks in
+        when more than DIRECT_SAMPLES rows are sampled at once, but
+        either way this avoids computing the frames one v at a time.
+        """
+        step = util.uniform_step(vs)
+        if step is None:
+            return super().sample_frames(vs)
+
+        phi0, phif = self.angles
+        dphi = phif - phi0
+        z0, zf = self.heights
+        dz = zf - z0
+
+        start_angle = util.lerp(self.angles, vs[0])
+        c, s = util.rotation_samples(start_angle, dphi * step, len(vs))
+
+        z = util.lerp(self.heights, vs)
+        P = np.stack([c, s, z], axis=1)
+
+        T = np.stack([-s * dphi, c * dphi, np.full(len(vs), dz)], axis=1)
+        T = util.normalize_rows(T)
+
+        dphi_sqr = dphi * dphi
+        N = np.stack([-dphi_sqr * c, -dphi_sqr * s, np.zeros(len(vs))], axis=1)
+        N = util.normalize_rows(N)
+
+        B = np.cross(T, N)
+        return (P, T, N, B)
+
 class Transformed(Path):
     """
     Transform the path with an XForm
     """
-    def __init__(self, path, xform):
+    def __init__(self, path, xform, vectorized=False):
         """
         path is the path to wrap
         xform is either a callable f(pos, v): XForm or an XForm
+
+        vectorized: set this to True if xform is a function that also
+            works on arrays: f(positions, vs) with an (n, 3) array and
+            an array of n v values, returning an XForm whose parameters
+            are arrays with one value per sample. Then sample_frames()
+            calls it once and transforms all the frames as arrays.
         """
         self.path = path
         self.xform = xform
+        self.vectorized = vectorized
 
     def get_xform(self, pos, v):
         """
@@ -226,3 +291,153 @@ class Transformed(Path):
         transformed = jac_inv_T * N
         transformed.normalize()
         return transformed
+
+    def sample_frames(self, vs):
+        """
+        Sample the wrapped path in one batch, then transform the samples.
+        Same math as position(), tangent() and normal()
+        """
+        if self.vectorized or not callable(self.xform):
+            return self.transform_frames(vs)
+
+        P, T, N, B = self.path.sample_frames(vs)
+
+        I = Matrix((
+            (1, 0, 0),
+            (0, 1, 0),
+            (0, 0, 1)))
+
+        for k, v in enumerate(vs):
+            pos = Vector(P[k])
+            xform = self.get_xform(pos, v)
+
+            jac = xform.jacobian(pos)
+            tangent = jac * Vector(T[k])
+            tangent.normalize()
+
+            jac_inv_T = jac.copy()
+            jac_inv_T.invert(I)
+            jac_inv_T.transpose()
+            normal = jac_inv_T * Vector(N[k])
+            normal.normalize()
+
+            P[k] = xform.transform(pos)
+            T[k] = tangent
+            N[k] = normal
+            B[k] = tangent.cross(normal)
+        return (P, T, N, B)
+
+    def transform_frames(self, vs):
+        """
+        sample_frames() for a constant or vectorized xform: every sample
+        is transformed at once with XForm.transform_points() and
+        XForm.jacobians()
+        """
+        P, T, N, B = self.path.sample_frames(vs)
+        if callable(self.xform):
+            xform = self.xform(P, vs)
+        else:
+            xform = self.xform
+        jacobians = xform.jacobians(P)
+
+        tangents = np.einsum('nij,nj->ni', jacobians, T)
+
+        # Like Matrix.invert() in normal(), fall back to the identity
+        # where the jacobian is singular
+        inverses = np.broadcast_to(np.eye(3), jacobians.shape).copy()
+        invertible = np.linalg.det(jacobians) != 0.0
+        inverses[invertible] = np.linalg.inv(jacobians[invertible])
+        normals = np.einsum('nji,nj->ni', inverses, N)
+
+        tangents = util.normalize_rows(tangents)
+        normals = util.normalize_rows(normals)
+        return (
+            xform.transform_points(P), tangents, normals,
+            np.cross(tangents, normals))
+
+class Baked(Path):
+    """
+    Lookup table version of a path. The original path is sampled once,
+    then positions and frames are found by binary search and linear
+    interpolation. This makes deep chains of Transformed paths as cheap to
+    evaluate as a table lookup, which pays off when the same path is used
+    many times or at many resolutions.
+    """
+    def __init__(self, path, samples=256):
+        """
+        path: the Path to bake
+
+        samples: either the number of evenly spaced intervals to sample
+            or a sorted sequence of v values to sample at. Use more samples
+            where the path bends sharply.
+        """
+        if isinstance(samples, numbers.Integral):
+            vs = np.linspace(0.0, 1.0, samples + 1)
+        else:
+            vs = np.asarray(samples, dtype=float)
+
+        self.vs = vs
+        self.P, self.T, self.N, self.B = path.sample_frames(vs)
+
+    def locate(self, v):
+        """
+        Find the interval [vs[k], vs[k + 1]] that v falls in and how far
+        along the interval v is.
+
+        returns (k, t)
+        """
+        k = bisect.bisect_right(self.vs, v) - 1
+        k = min(max(k, 0), len(self.vs) - 2)
+        t = (v - self.vs[k]) / (self.vs[k + 1] - self.vs[k])
+        return k, t
+
+    def lookup(self, table, v):
+        k, t = self.locate(v)
+        return Vector(table[k] * (1.0 - t) + table[k + 1] * t)
+
+    def position(self, v):
+        return self.lookup(self.P, v)
+
+    def tangent(self, v):
+        T = self.lookup(self.T, v)
+        T.normalize()
+        return T
+
+    def normal(self, v):
+        """
+        Interpolating two unit normals gives a vector that is neither unit
+        length nor exactly perpendicular to the tangent. Fix both.
+        """
+        T = self.tangent(v)
+        N = self.lookup(self.N, v)
+        N = N - T * N.dot(T)
+        N.normalize()
+        return N
+
+    def frenet_frame(self, v):
+        T = self.tangent(v)
+        N = self.normal(v)
+        B = T.cross(N)
+        return (T, N, B)
+
+    def sample_frames(self, vs):
+        """
+        Same as position() and frenet_frame() but the binary search and
+        interpolation are done for all the v values at once.
+        """
+        vs = np.asarray(vs, dtype=float)
+        k = np.searchsorted(self.vs, vs, side='right') - 1
+        k = np.clip(k, 0, len(self.vs) - 2)
+        t = (vs - self.vs[k]) / (self.vs[k + 1] - self.vs[k])
+        t = t[:, np.newaxis]
+
+        def lookup(table):
+            return table[k] * (1.0 - t) + table[k + 1] * t
+
+        P = lookup(self.P)
+        T = util.normalize_rows(lookup(self.T))
+        N = lookup(self.N)
+        N = N - T * np.sum(N * T, axis=1, keepdims=True)
+        N = util.normalize_rows(N)
+        B = np.cross(T, N)
+        return (P, T, N, B)
@@ -0,0 +1,276 @@
+"""
+Progressive builds: link a low resolution preview of a shape right away,
+then compute the full resolution mesh a few rows at a time from a modal
+operator so the UI stays responsive. When all the rows are done, the
+preview's mesh data is swapped for the full resolution mesh.
+
+Call register() once, then ExtrudedShape.build_progressive() or start().
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bpy
+import numpy as np
+
+import uv_mesh
+
+# The preview has 1 / PREVIEW_DIVISOR of the resolution in each direction
+PREVIEW_DIVISOR = 8
+
+# Vertices evaluated in the first block of a build. The time is only
+# checked between blocks, so the number of rows per block is picked from
+# the width of the mesh rather than fixed. After the first block, it is
+# adapted to the measured speed
+BLOCK_SAMPLES = 4096
+
+# Fraction of the time slice one block should take, so the last block of
+# a slice can't run far past the end of it
+BLOCK_FRACTION = 0.25
+
+# Seconds of work per timer tick before handing control back to Blender
+TIME_SLICE = 0.02
+
+# Seconds between timer ticks
+TICK = 0.01
+
+# name -> ProgressiveBuild of the builds waiting for the operator to
+# pick them up or currently running
+builds = {}
+
+# name -> object of the last cancelled build. A cancelled build is
+# removed from builds, but the next build with the same name shows its
+# preview in the same object instead of linking a new one
+cancelled_objects = {}
+
+class ProgressiveBuild:
+    """
+    The state of one progressive build
+    """
+    def __init__(
+            self, shape, name, ordering='column', dtype=np.float64,
+            obj=None, workers=1):
+        """
+        shape: the ExtrudedShape to build
+        name: name of the new object
+        ordering: vertex/face order, see grid_order.ORDERINGS
+        dtype: precision of the vertex buffer
+        obj: an existing object to show the preview in instead of making
+            a new one, e.g. the object of a cancelled build
+        workers: number of threads that share the rows of each block
+        """
+        self.shape = shape
+        self.name = name
+        self.ordering = ordering
+        self.dtype = dtype
+        self.cancelled = False
+
+        # Remember the parameters so the build can be cancelled if they
+        # change halfway through
+        self.params = dict(shape.params)
+
+        self.obj = self.build_preview(obj)
+
+        self.surface = shape.make_surface()
+        self.us, self.vs = uv_mesh.make_uv_params(shape.u_res, shape.v_res)
+        self.grid = np.empty(
+            (shape.u_res + 1, shape.v_res + 1, 3), dtype=dtype)
+        self.next_row = 0
+        self.block_rows = max(1, BLOCK_SAMPLES // len(self.us))
+
+        self.workers = workers
+        self.executor = None
+        if workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def build_preview(self, obj):
+        u_res = max(3, self.shape.u_res // PREVIEW_DIVISOR)
+        v_res = max(2, self.shape.v_res // PREVIEW_DIVISOR)
+        preview = type(self.shape)(u_res, v_res, **self.params)
+        if obj is None:
+            return preview.build(
+                self.name, ordering=self.ordering, dtype=self.dtype)
+
+        grid = preview.make_grid(self.dtype)
+        replace_mesh(obj, self.make_mesh(grid))
+        return obj
+
+    def make_mesh(self, grid):
+        structured_grid = uv_mesh.StructuredGrid(grid, self.ordering)
+        return structured_grid.to_mesh(self.name)
+
+    @property
+    def done(self):
+        return self.next_row >= len(self.vs)
+
+    @property
+    def progress(self):
+        return self.next_row / len(self.vs)
+
+    def params_changed(self):
+        return self.shape.params != self.params
+
+    def step(self, time_slice=TIME_SLICE):
+        """
+        Evaluate blocks of rows until time_slice seconds have passed.
+        Returns True when all the rows are done.
+        """
+        start_time = time.perf_counter()
+        while not self.done:
+            start = self.next_row
+            stop = min(start + self.block_rows, len(self.vs))
+            block_start = time.perf_counter()
+            self.evaluate_rows(start, stop)
+            self.next_row = stop
+
+            now = time.perf_counter()
+            self.adapt_block_rows(stop - start, now - block_start, time_slice)
+            if now - start_time > time_slice:
+                break
+        return self.done
+
+    def evaluate_rows(self, start, stop):
+        """
+        Evaluate rows start to stop of the grid, split between the
+        workers if there is more than one
+        """
+        if self.executor is None:
+            self.surface.evaluate(
+                self.us, self.vs[start:stop], self.grid[:, start:stop])
+            return
+
+        bounds = np.linspace(start, stop, self.workers + 1).astype(int)
+        futures = [
+            self.executor.submit(
+                self.surface.evaluate, self.us, self.vs[i0:i1],
+                self.grid[:, i0:i1])
+            for i0, i1 in zip(bounds[:-1], bounds[1:]) if i1 > i0]
+        # result() so exceptions from the workers are raised here
+        for future in futures:
+            future.result()
+
+    def adapt_block_rows(self, rows, seconds, time_slice):
+        """
+        Size the next block so it takes about BLOCK_FRACTION of the time
+        slice at the speed of the last one. A single row can't be split,
+        so a mesh where one row takes longer than the whole slice still
+        runs over.
+        """
+        if seconds <= 0.0:
+            return
+        seconds_per_row = seconds / rows
+        target = BLOCK_FRACTION * time_slice / seconds_per_row
+        self.block_rows = max(1, int(target))
+
+    def finish(self):
+        """
+        Replace the preview mesh of the object with the full resolution
+        mesh
+        """
+        replace_mesh(self.obj, self.make_mesh(self.grid))
+        self.shutdown()
+
+    def cancel(self):
+        self.cancelled = True
+        cancelled_objects[self.name] = self.obj
+        self.shutdown()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+def replace_mesh(obj, mesh):
+    """
+    Swap the mesh data of an object and delete the old mesh
+    """
+    old_mesh = obj.data
+    obj.data = mesh
+    bpy.data.meshes.remove(old_mesh)
+
+def start(shape, name, ordering='column', dtype=np.float64, workers=1):
+    """
+    Start a progressive build of shape. A build that is already running
+    for the same name is cancelled first. The object of a running or
+    cancelled build with the same name is reused for the preview.
+    workers is the number of threads that evaluate the rows.
+
+    Returns the ProgressiveBuild. Its obj holds the preview right away.
+    """
+    if name in builds:
+        builds[name].cancel()
+    obj = cancelled_objects.pop(name, None)
+    if obj is not None and not object_exists(obj):
+        obj = None
+
+    build = ProgressiveBuild(shape, name, ordering, dtype, obj, workers)
+    builds[name] = build
+    bpy.ops.pasta.progressive_build('INVOKE_DEFAULT', name=name)
+    return build
+
+def object_exists(obj):
+    """
+    Check that obj was not deleted since it was stored
+    """
+    try:
+        return bpy.data.objects.get(obj.name) == obj
+    except ReferenceError:
+        return False
+
+class ProgressiveBuildOperator(bpy.types.Operator):
+    """
+    Modal operator that runs a ProgressiveBuild in time slices. Press
+    Esc to cancel and keep the preview.
+    """
+    bl_idname = 'pasta.progressive_build'
+    bl_label = "Progressive Pasta Build"
+
+    name = bpy.props.StringProperty()
+
+    def invoke(self, context, event):
+        self.build = builds.get(self.name)
+        if self.build is None:
+            return {'CANCELLED'}
+
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(TICK, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self.build.cancel()
+
+        if self.build.params_changed():
+            self.build.cancel()
+
+        if self.build.cancelled:
+            self.stop(context)
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self.build.step():
+            self.build.finish()
+            self.stop(context)
+            return {'FINISHED'}
+
+        if context.area is not None:
+            context.area.header_text_set("Building {}: {:.0%}".format(
+                self.name, self.build.progress))
+        return {'PASS_THROUGH'}
+
+    def stop(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        if context.area is not None:
+            context.area.header_text_set()
+
+        # A newer build with the same name may have replaced this one
+        if builds.get(self.name) is self.build:
+            del builds[self.name]
+
+def register():
+    bpy.utils.register_class(ProgressiveBuildOperator)
+
+def unregister():
+    bpy.utils.unregister_class(ProgressiveBuildOperator)
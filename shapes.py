@@ -1,15 +1,27 @@
 import math
 
+import numpy as np
 from mathutils import Vector
 
 import cross_section
+import intersections
 import path
+import progressive
 import uv_mesh
 import util
 import xforms
-from extruded_surface import ExtrudedSurface
+from extruded_surface import ExtrudedSurface, MultiExtrudedSurface
+
+class Shape:
+    """
+    Parameters shared by every kind of shape. Subclasses decide what
+    gets extruded along make_path(), see ExtrudedShape and
+    MultiExtrudedShape
+    """
+    # Set this to True if the cross section is a closed curve, so the first
+    # and last columns of the mesh touch.
+    cyclic_u = False
 
-class ExtrudedShape:
     def __init__(self, u_res, v_res, **params):
         self.u_res = u_res
         self.v_res = v_res
@@ -42,13 +54,84 @@ class ExtrudedShape:
         param = self.params[param_name]
         return util.loglerp(param, t)
 
-    def build(self, name):
+    def make_path(self):
+        """
+        Make the path for extruding the shape
+        Start from a basic path and apply transformations/concatenations to
+        make the desired shape.
+        """
+        raise NotImplementedError
+
+class ExtrudedShape(Shape):
+    """
+    A single cross section extruded along a path
+    """
+    def make_surface(self):
         cs = self.make_cross_section()
         pth = self.make_path()
-        surf = ExtrudedSurface(cs, pth)
+        return ExtrudedSurface(cs, pth)
 
-        bm = uv_mesh.make_uv_mesh(self.u_res, self.v_res, surf)
-        util.link_mesh(name, bm)
+    def make_grid(self, dtype=np.float64, workers=1):
+        """
+        Evaluate the vertex positions of the shape without creating
+        any Blender data. dtype sets the precision of the returned array
+        and workers the number of threads to evaluate it with.
+        """
+        surf = self.make_surface()
+        return uv_mesh.make_uv_grid(
+            self.u_res, self.v_res, surf, dtype, workers)
+
+    def find_self_intersections(self, grid=None):
+        """
+        List the pairs of faces that pass through each other. This is
+        useful for rejecting bad parameters in a sweep before building
+        anything.
+        """
+        if grid is None:
+            grid = self.make_grid()
+        return intersections.find_self_intersections(
+            grid, cyclic_u=self.cyclic_u)
+
+    def build(self, name, validate=False, ordering='column',
+            dtype=np.float64, workers=1):
+        """
+        Build the mesh and link it into the scene. If validate is True,
+        check the surface for self-intersections first and raise a
+        SelfIntersectionError instead of building a broken mesh.
+
+        ordering is one of grid_order.ORDERINGS, for meshes headed to
+        the viewport or a game engine 'strips' is much more cache friendly.
+
+        dtype is the precision of the vertex buffer. Blender stores float32
+        coordinates, so np.float32 halves the memory of the largest meshes
+        at no visible cost.
+
+        workers is the number of threads to evaluate the grid with, see
+        uv_mesh.make_uv_grid()
+
+        Returns the new Blender object
+        """
+        grid = self.make_grid(dtype, workers)
+
+        if validate:
+            pairs = self.find_self_intersections(grid)
+            if pairs:
+                raise intersections.SelfIntersectionError(name, pairs)
+
+        mesh = uv_mesh.StructuredGrid(grid, ordering).to_mesh(name)
+        return util.link_object(name, mesh)
+
+    def build_progressive(
+            self, name, ordering='column', dtype=np.float64, workers=1):
+        """
+        Like build(), but link a low resolution preview right away and
+        fill in the full resolution mesh in the background without
+        freezing the UI. Changing self.params before it finishes cancels
+        the build. Needs progressive.register() to have been called.
+
+        Returns a progressive.ProgressiveBuild
+        """
+        return progressive.start(self, name, ordering, dtype, workers)
 
     def make_cross_section(self):
         """
@@ -57,15 +140,83 @@ class ExtrudedShape:
         """
         raise NotImplementedError
 
-    def make_path(self):
+class MultiExtrudedShape(Shape):
+    """
+    A shape made of several cross sections extruded along the same path,
+    like nested tubes or the inner and outer walls of a shell. The path
+    is only evaluated once for all of the surfaces.
+
+    This is not an ExtrudedShape since it has no single surface or grid.
+    Subclasses implement make_cross_sections() and make_path()
+    """
+    def make_cross_sections(self):
         """
-        Make the path for extruding the shape
-        Start from a basic path and apply transformations/concatenations to
-        make the desired shape.
+        Return a list of (cross_section, u_res) pairs, one per surface.
+        Each surface can have its own resolution in the u direction.
         """
         raise NotImplementedError
 
+    def make_grids(self, dtype=np.float64, workers=1):
+        """
+        Evaluate the vertex positions of every surface, see
+        ExtrudedShape.make_grid()
+        """
+        layers = self.make_cross_sections()
+        cross_sections = [cs for cs, _ in layers]
+        u_res_list = [u_res for _, u_res in layers]
+
+        surf = MultiExtrudedSurface(cross_sections, self.make_path())
+        return uv_mesh.make_uv_grids(
+            u_res_list, self.v_res, surf, dtype, workers)
+
+    def find_self_intersections(self, grids=None):
+        """
+        List the self-intersecting pairs of faces of each surface.
+        Intersections between different surfaces are not checked.
+        """
+        if grids is None:
+            grids = self.make_grids()
+        return [
+            intersections.find_self_intersections(grid, cyclic_u=self.cyclic_u)
+            for grid in grids
+        ]
+
+    def build(self, name, validate=False, ordering='column',
+            dtype=np.float64, combined=True, workers=1):
+        """
+        Build the surfaces and link them into the scene, either as
+        one combined object or as one object per surface named
+        name_0, name_1, ... See ExtrudedShape.build() for the other
+        arguments.
+
+        Returns the object or the list of objects.
+        """
+        grids = self.make_grids(dtype, workers)
+
+        if validate:
+            for k, pairs in enumerate(self.find_self_intersections(grids)):
+                if pairs:
+                    layer_name = '{}_{}'.format(name, k)
+                    raise intersections.SelfIntersectionError(
+                        layer_name, pairs)
+
+        structured_grids = [
+            uv_mesh.StructuredGrid(grid, ordering) for grid in grids]
+
+        if combined:
+            mesh = uv_mesh.grids_to_mesh(name, structured_grids)
+            return util.link_object(name, mesh)
+
+        objects = []
+        for k, structured_grid in enumerate(structured_grids):
+            layer_name = '{}_{}'.format(name, k)
+            mesh = structured_grid.to_mesh(layer_name)
+            objects.append(util.link_object(layer_name, mesh))
+        return objects
+
 class Cylinder(ExtrudedShape):
+    cyclic_u = True
+
     @property
     def default_params(self):
         return {
@@ -98,6 +249,8 @@ class SuperSeashell(ExtrudedShape):
     """
     My super-seashells family of parametric surfaces.
     """
+    cyclic_u = True
+
     @property
     def default_params(self): 
         return {
@@ -128,10 +281,13 @@ class SuperSeashell(ExtrudedShape):
             twist_angle = self.lerp_param('cross_section_twist', v)
             return xforms.RotateZ(twist_angle) 
 
+        # The xforms only depend on v, so each row of the grid is
+        # transformed as one array
         cs = cross_section.Circle()
-        cs = cross_section.Transformed(cs, make_superellipse)
-        cs = cross_section.Transformed(cs, taper)
-        cs = cross_section.Transformed(cs, twist)
+        cs = cross_section.Transformed(
+            cs, make_superellipse, depends_on_u=False)
+        cs = cross_section.Transformed(cs, taper, depends_on_u=False)
+        cs = cross_section.Transformed(cs, twist, depends_on_u=False)
         return cs
 
     def make_path(self):
@@ -143,12 +299,14 @@ class SuperSeashell(ExtrudedShape):
         def spiral(pos, v):
             R = self.lerp_param('coil_radius', v)
             b = self.loglerp_param('coil_logarithm', v)
-            scale_factor = R * math.exp(b)
+            scale_factor = R * np.exp(b)
             return xforms.Scale(scale_factor, scale_factor, 1.0)
-            
+
+        # Both xforms work on arrays of v values too, so the frames of a
+        # whole block are transformed at once
         pth = path.Helix(self.params['coil_z'], self.params['coil_angle'])
-        pth = path.Transformed(pth, make_superellipse)
-        pth = path.Transformed(pth, spiral)
+        pth = path.Transformed(pth, make_superellipse, vectorized=True)
+        pth = path.Transformed(pth, spiral, vectorized=True)
         return pth
 
 class LissajousPasta(ExtrudedShape):
@@ -185,13 +343,51 @@ class LissajousPasta(ExtrudedShape):
             offset = self.lerp_param('cross_section_offset', v)
             return xforms.Translate(offset)
 
+        # The xforms only depend on v, so each row of the grid is
+        # transformed as one array
         cs = cross_section.Lissajous(a, b)
-        cs = cross_section.Transformed(cs, taper)
-        cs = cross_section.Transformed(cs, twist)
-        cs = cross_section.Transformed(cs, shear)
+        cs = cross_section.Transformed(cs, taper, depends_on_u=False)
+        cs = cross_section.Transformed(cs, twist, depends_on_u=False)
+        cs = cross_section.Transformed(cs, shear, depends_on_u=False)
         return cs
 
     def make_path(self):
         z0, zf = self.params['path_z']
         pth = path.Line(Vector((0, z0, 0)), Vector((0, zf, 0)))
         return pth
+
+class NestedTubes(MultiExtrudedShape):
+    """
+    Concentric tubes extruded along the same line, like a rigatone with
+    a core
+    """
+    cyclic_u = True
+
+    @property
+    def default_params(self):
+        return {
+            # start and end of the path.
+            'heights': (Vector((-1, 0, 0)), Vector((1, 0, 0))),
+            # radius of each tube, from the outside in.
+            'radii': (1.0, 0.6)
+        }
+
+    def make_cross_sections(self):
+        """
+        One circle per radius. Smaller circles need fewer columns to look
+        as smooth, so scale u_res by the radius relative to the largest
+        """
+        radii = self.params['radii']
+        largest = max(radii)
+
+        layers = []
+        for radius in radii:
+            scale = xforms.Scale(radius, radius, 1.0)
+            cs = cross_section.Transformed(cross_section.Circle(), scale)
+            u_res = max(3, int(round(self.u_res * radius / largest)))
+            layers.append((cs, u_res))
+        return layers
+
+    def make_path(self):
+        z0, zf = self.params['heights']
+        return path.Line(z0, zf)
@@ -1,18 +1,34 @@
+import math
+import functools
+
 import bpy
 import bmesh
+import numpy as np
 
 def link_mesh(name, bm):
     """
     Create a Blender object + and a mesh to go with it. the mesh
-    has vertices loaded from a bmesh. The bmesh is freed at the end
+    has vertices loaded from a bmesh. The bmesh is freed at the end.
+
+    Returns the new object
     """
     # Add the mesh to the scene
     mesh = bpy.data.meshes.new(name + '_mesh')
-    obj = bpy.data.objects.new(name, mesh)
-    bpy.context.scene.objects.link(obj)
+    obj = link_object(name, mesh)
 
     bm.to_mesh(mesh)
     bm.free()
+    return obj
+
+def link_object(name, mesh):
+    """
+    Create a Blender object for an existing mesh and add it to the scene.
+
+    Returns the new object
+    """
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.objects.link(obj)
+    return obj
 
 def lerp(params, t):
     """
@@ -36,4 +52,69 @@ def loglerp(params, t):
     """
     initial, final = params
     return initial ** (1.0 - t) * final ** (t)
-    
+
+# Below this many angles, rotation_samples() just calls cos/sin
+DIRECT_SAMPLES = 512
+
+def uniform_step(values):
+    """
+    If the values in the array are evenly spaced, return the spacing.
+    Otherwise return None.
+    """
+    if len(values) < 2:
+        return 0.0
+
+    step = (values[-1] - values[0]) / (len(values) - 1)
+    if np.allclose(np.diff(values), step, rtol=1e-9, atol=1e-12):
+        return step
+    return None
+
+def rotation_samples(theta0, dtheta, count):
+    """
+    Compute cos(theta) and sin(theta) for the evenly spaced angles
+    theta0 + k * dtheta, k = 0, 1, ..., count - 1 without calling cos/sin
+    for every angle.
+
+    Write k = i * block + j with block about sqrt(count). Then
+    e^(i theta) is a coarse phasor e^(i (theta0 + i * block * dtheta))
+    times a fine phasor e^(i j dtheta), so the whole table is an outer
+    product of two tables of about sqrt(count) exp() calls each. Every
+    angle is a single complex multiply of two unit phasors, so the error
+    stays at a few ulps no matter how many angles there are.
+
+    For fewer than DIRECT_SAMPLES angles, cos/sin is faster.
+
+    Returns (cos, sin) as two float64 arrays
+    """
+    if count < DIRECT_SAMPLES:
+        theta = theta0 + dtheta * np.arange(count)
+        return np.cos(theta), np.sin(theta)
+
+    block = int(math.ceil(math.sqrt(count)))
+    block_count = -(-count // block)
+    fine = np.exp(1j * dtheta * np.arange(block))
+    coarse = np.exp(1j * (theta0 + block * dtheta * np.arange(block_count)))
+    phasors = (coarse[:, np.newaxis] * fine[np.newaxis, :]).ravel()[:count]
+
+    return phasors.real, phasors.imag
+
+@functools.lru_cache(maxsize=16)
+def cached_rotation_samples(theta0, dtheta, count):
+    """
+    rotation_samples() for tables that are needed over and over, like the
+    angles of a cross section, which are the same for every row of a
+    grid. The arrays are shared between callers, so they are read-only.
+    """
+    c, s = rotation_samples(theta0, dtheta, count)
+    c.flags.writeable = False
+    s.flags.writeable = False
+    return c, s
+
+def normalize_rows(vectors):
+    """
+    Normalize each row of an (n, 3) array. Like Vector.normalize(),
+    rows of length 0 are left as they are.
+    """
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    lengths[lengths == 0.0] = 1.0
+    return vectors / lengths
@@ -1,7 +1,11 @@
 import bpy
 import bmesh
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from mathutils import Vector
 
+import grid_order
+
 def make_uvs(u_quads, v_quads):
     """
     Create a UV mesh with u_quads quads in the u direction
@@ -15,28 +19,260 @@ def make_uvs(u_quads, v_quads):
             v = j / v_quads
             yield (i, j), (u, v)
 
-def make_uv_mesh(u_quads, v_quads, surface):
+def make_uv_params(u_quads, v_quads):
     """
-    Make a parametric mesh with u_quads in the u_direction, v_quads in the
-    v direction, and a shape that is defined by the ExtrudedSurface
-    passed in.
+    Batched version of make_uvs(): return arrays (us, vs) of the u and v
+    values of the grid lines
+    """
+    us = np.arange(u_quads + 1) / u_quads
+    vs = np.arange(v_quads + 1) / v_quads
+    return us, vs
+
+# Number of rows of vertices (in the v direction) evaluated together.
+BLOCK_ROWS = 64
+
+def make_uv_grid(
+        u_quads, v_quads, surface, dtype=np.float64, workers=1,
+        block_rows=BLOCK_ROWS):
+    """
+    Evaluate the surface at every vertex of a UV grid with u_quads quads in
+    the u direction and v_quads quads in the v direction.
+
+    This returns an array of shape (u_quads + 1, v_quads + 1, 3) where
+    grid[i, j] is the position at (u, v) = (i / u_quads, j / v_quads)
+
+    dtype controls the precision of the output buffer. Blender and most
+    export formats store float32 coordinates anyway, so np.float32 halves
+    the memory of large meshes. See check_precision() for how much
+    accuracy this costs.
+
+    The rows of the grid are independent, so the v range is split into
+    blocks of block_rows rows that are evaluated by a pool of workers
+    threads. Each block writes to its own slice of the grid. The blocks
+    only depend on block_rows, so the result is the same no matter how
+    many workers are used.
+    """
+    us, vs = make_uv_params(u_quads, v_quads)
+    grid = np.empty((u_quads + 1, v_quads + 1, 3), dtype=dtype)
+
+    def evaluate_block(start, stop):
+        surface.evaluate(us, vs[start:stop], grid[:, start:stop])
+
+    evaluate_blocks(v_quads, evaluate_block, workers, block_rows)
+    return grid
+
+def make_uv_grids(
+        u_quads_list, v_quads, surface, dtype=np.float64, workers=1,
+        block_rows=BLOCK_ROWS):
+    """
+    Like make_uv_grid(), but for a MultiExtrudedSurface. Each surface gets
+    its own number of quads in the u direction from u_quads_list, but
+    they all share the same v_quads.
+
+    Returns a list of grids, one per surface
+    """
+    us_list = [np.arange(u_quads + 1) / u_quads for u_quads in u_quads_list]
+    vs = np.arange(v_quads + 1) / v_quads
+    grids = [
+        np.empty((u_quads + 1, v_quads + 1, 3), dtype=dtype)
+        for u_quads in u_quads_list
+    ]
+
+    def evaluate_block(start, stop):
+        outs = [grid[:, start:stop] for grid in grids]
+        surface.evaluate(us_list, vs[start:stop], outs)
+
+    evaluate_blocks(v_quads, evaluate_block, workers, block_rows)
+    return grids
+
+def evaluate_blocks(v_quads, evaluate_block, workers, block_rows):
+    """
+    Call evaluate_block(start, stop) for each block of block_rows rows of
+    vertices, using a pool of workers threads if workers > 1
+    """
+    starts = range(0, v_quads + 1, block_rows)
+
+    def run(start):
+        evaluate_block(start, min(start + block_rows, v_quads + 1))
+
+    if workers == 1:
+        for start in starts:
+            run(start)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() so exceptions from the workers are raised here
+            list(executor.map(run, starts))
+
+def check_precision(u_quads, v_quads, surface, dtype=np.float32):
+    """
+    Accuracy check for reduced precision grids. Evaluate the surface
+    in dtype and in float64 and compare the two.
+
+    Since the surface is always computed in double precision, each
+    coordinate of the reduced grid is only rounded once, so the error
+    is at most half an ulp: |error| <= eps / 2 * |x|. The returned bound
+    uses the full machine epsilon of dtype times the largest coordinate
+    magnitude, which leaves some headroom.
+
+    Returns (max_error, bound). max_error <= bound means the reduced
+    precision grid is as accurate as that precision allows.
+    """
+    reference = make_uv_grid(u_quads, v_quads, surface, np.float64)
+    reduced = make_uv_grid(u_quads, v_quads, surface, dtype)
+
+    max_error = float(np.abs(reduced - reference).max())
+    bound = float(np.finfo(dtype).eps * np.abs(reference).max())
+    return max_error, bound
+
+def grid_to_bmesh(grid, ordering='column'):
+    """
+    Turn a grid of positions from make_uv_grid() into a bmesh made of quads
+
+    ordering is one of grid_order.ORDERINGS. Orderings other than the
+    default 'column' store the vertices and faces in a layout that is
+    friendlier to the GPU vertex cache.
+    """
+    return grids_to_bmesh([grid], ordering)
+
+def grids_to_bmesh(grids, ordering='column'):
+    """
+    Combine several grids (e.g. from make_uv_grids()) into a single bmesh.
+    The grids are not connected to each other.
     """
     bm = bmesh.new()
 
-    # Make an empty grid to store the vertices
-    verts = [[None] * (v_quads + 1) for i in range(u_quads + 1)]
-
-    for (i, j), (u, v) in make_uvs(u_quads, v_quads):
-        pos = surface.position(u, v)
-        verts[i][j] = bm.verts.new(pos)
-
-    for i in range(u_quads):
-        for j in range(v_quads):
-            face_verts = [
-                verts[i][j],
-                verts[i + 1][j],
-                verts[i + 1][j + 1],
-                verts[i][j + 1]
-            ]
-            bm.faces.new(face_verts)
+    for grid in grids:
+        u_verts, v_verts, _ = grid.shape
+        vertex_order, faces = grid_order.ordered_mesh(
+            u_verts - 1, v_verts - 1, ordering)
+
+        positions = grid.reshape(-1, 3)
+        verts = [bm.verts.new(Vector(positions[k])) for k in vertex_order]
+
+        for a, b, c, d in faces.tolist():
+            bm.faces.new([verts[a], verts[b], verts[c], verts[d]])
     return bm
+
+def make_uv_mesh(u_quads, v_quads, surface, workers=1):
+    """
+    Make a parametric mesh with u_quads in the u_direction, v_quads in the
+    v direction, and a shape that is defined by the ExtrudedSurface
+    passed in. workers is the number of threads, see make_uv_grid()
+    """
+    grid = make_uv_grid(u_quads, v_quads, surface, workers=workers)
+    return grid_to_bmesh(grid)
+
+class StructuredGrid:
+    """
+    Mesh of a UV grid that only stores the vertex positions. The faces of
+    a grid are completely determined by its size, so they are computed
+    on demand (and cached per grid size by grid_order.ordered_mesh())
+    instead of being stored as millions of Python objects.
+    """
+    def __init__(self, positions, ordering='column'):
+        """
+        positions: grid from make_uv_grid() with shape
+            (u_quads + 1, v_quads + 1, 3)
+        ordering: vertex/face order, one of grid_order.ORDERINGS
+        """
+        self.positions = positions
+        self.ordering = ordering
+
+    @property
+    def u_quads(self):
+        return self.positions.shape[0] - 1
+
+    @property
+    def v_quads(self):
+        return self.positions.shape[1] - 1
+
+    @property
+    def topology(self):
+        return grid_order.ordered_mesh(
+            self.u_quads, self.v_quads, self.ordering)
+
+    @property
+    def vertices(self):
+        """
+        (n, 3) array of vertex positions in mesh order. For 'column'
+        order this is a view of the positions, not a copy
+        """
+        if self.ordering == 'column':
+            return self.positions.reshape(-1, 3)
+
+        vertex_order, _ = self.topology
+        return self.positions.reshape(-1, 3)[vertex_order]
+
+    @property
+    def faces(self):
+        """
+        (n, 4) read-only array of vertex indices, one row per quad
+        """
+        _, faces = self.topology
+        return faces
+
+    def iter_faces(self):
+        """
+        Generate the faces one at a time as tuples of 4 vertex indices
+        without building the whole index array. Only for the default
+        'column' ordering.
+        """
+        if self.ordering != 'column':
+            raise ValueError("iter_faces() only supports 'column' ordering")
+
+        v_verts = self.v_quads + 1
+        for i in range(self.u_quads):
+            for j in range(self.v_quads):
+                first = i * v_verts + j
+                yield (first, first + v_verts, first + v_verts + 1, first + 1)
+
+    def to_mesh(self, name):
+        """
+        Create a Blender mesh with the bulk foreach_set() API. See
+        grids_to_mesh()
+        """
+        return grids_to_mesh(name, [self])
+
+def grids_to_mesh(name, structured_grids):
+    """
+    Load one or more StructuredGrids into a single Blender mesh without
+    going through bmesh. The grids are not connected to each other.
+
+    Returns the new mesh
+    """
+    vertices = []
+    faces = []
+    offset = 0
+    for grid in structured_grids:
+        vertices.append(grid.vertices)
+        grid_faces = grid.faces
+        if offset > 0:
+            grid_faces = grid_faces + offset
+        faces.append(grid_faces)
+        offset += len(vertices[-1])
+
+    # A single float32 grid goes to Blender without any copies
+    if len(structured_grids) == 1:
+        vertices = vertices[0]
+        faces = faces[0]
+    else:
+        vertices = np.concatenate(vertices)
+        faces = np.concatenate(faces)
+    vertices = vertices.astype(np.float32, copy=False)
+    loops = faces.astype(np.int32, copy=False).reshape(-1)
+    face_count = len(loops) // 4
+
+    mesh = bpy.data.meshes.new(name + '_mesh')
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set('co', vertices.reshape(-1))
+
+    mesh.loops.add(len(loops))
+    mesh.loops.foreach_set('vertex_index', loops)
+
+    mesh.polygons.add(face_count)
+    loop_start = np.arange(0, len(loops), 4, dtype=np.int32)
+    mesh.polygons.foreach_set('loop_start', loop_start)
+    mesh.polygons.foreach_set('loop_total', np.full(face_count, 4, np.int32))
+
+    mesh.update(calc_edges=True)
+    return mesh
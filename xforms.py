@@ -1,8 +1,26 @@
 import math
 
+import numpy as np
 from mathutils import Vector
 from mathutils import Matrix
 
+def stack_params(*params):
+    """
+    Stack XForm parameters that are either numbers or arrays with one
+    value per point into an array with one column per parameter. The
+    result broadcasts against an (n, 3) array of points.
+    """
+    return np.stack(np.broadcast_arrays(*params), axis=-1)
+
+def diagonal_jacobians(diagonals):
+    """
+    (n, 3, 3) array of diagonal matrices from an (n, 3) array of their
+    diagonals
+    """
+    jacobians = np.zeros(diagonals.shape + (3,))
+    jacobians[:, [0, 1, 2], [0, 1, 2]] = diagonals
+    return jacobians
+
 class XForm:
     def transform(self, point):
         """
@@ -10,6 +28,31 @@ class XForm:
         """
         raise NotImplementedError
 
+    def transform_points(self, points):
+        """
+        Batched version of transform() for an (n, 3) array of points.
+        Returns a new (n, 3) array.
+
+        Subclasses should override this with NumPy array math, which is
+        much faster and lets other threads run while it works. Scale,
+        Translate, RotateZ and SuperScale also accept parameters that are
+        arrays with one value per point, see path.Transformed.
+        """
+        result = np.empty(points.shape)
+        for k, point in enumerate(points):
+            result[k] = self.transform(Vector(point))
+        return result
+
+    def jacobians(self, points):
+        """
+        Batched version of jacobian() for an (n, 3) array of points.
+        Returns an (n, 3, 3) array.
+        """
+        result = np.empty(points.shape + (3,))
+        for k, point in enumerate(points):
+            result[k] = np.array(self.jacobian(Vector(point)))
+        return result
+
     def jacobian(self, point):
         """
         Partial Derivatives of the transformation. If this is defined,
@@ -40,6 +83,13 @@ class Scale(XForm):
             point.y * self.sy,
             point.z * self.sz))
 
+    def transform_points(self, points):
+        return points * stack_params(self.sx, self.sy, self.sz)
+
+    def jacobians(self, points):
+        factors = stack_params(self.sx, self.sy, self.sz)
+        return diagonal_jacobians(np.broadcast_to(factors, points.shape))
+
     def jacobian(self, point):
         return Matrix((
             (self.sx, 0.0, 0.0),
@@ -57,6 +107,12 @@ class Translate(XForm):
     def transform(self, point):
         return point + self.offset
 
+    def transform_points(self, points):
+        return points + np.asarray(self.offset)
+
+    def jacobians(self, points):
+        return diagonal_jacobians(np.ones(points.shape))
+
     def jacobian(self, point):
         """
         Since translation is just adding a constant, no volume scaling
@@ -84,6 +140,28 @@ class RotateZ(XForm):
         z = point.z
         return Vector((x, y, z))
 
+    def transform_points(self, points):
+        c = np.cos(self.angle)
+        s = np.sin(self.angle)
+
+        result = np.empty(points.shape)
+        result[:, 0] = points[:, 0] * c - points[:, 1] * s
+        result[:, 1] = points[:, 0] * s + points[:, 1] * c
+        result[:, 2] = points[:, 2]
+        return result
+
+    def jacobians(self, points):
+        c = np.broadcast_to(np.cos(self.angle), len(points))
+        s = np.broadcast_to(np.sin(self.angle), len(points))
+
+        result = np.zeros(points.shape + (3,))
+        result[:, 0, 0] = c
+        result[:, 0, 1] = -s
+        result[:, 1, 0] = s
+        result[:, 1, 1] = c
+        result[:, 2, 2] = 1.0
+        return result
+
     def jacobian(self, point):
         c = math.cos(self.angle)
         s = math.sin(self.angle)
@@ -121,6 +199,23 @@ class SuperScale(XForm):
         z = self.superfunc(point.z, self.p)
         return Vector((x, y, z))
 
+    def transform_points(self, points):
+        exponents = 2.0 / stack_params(self.n, self.m, self.p)
+        return np.sign(points) * np.abs(points) ** exponents
+
+    def jacobians(self, points):
+        """
+        Batched version of jacobian(), with the same value of 1.0 at 0.0
+        as superfunc_deriv()
+        """
+        exponents = np.broadcast_to(
+            2.0 / stack_params(self.n, self.m, self.p), points.shape)
+        zero = points == 0.0
+        magnitudes = np.where(zero, 1.0, np.abs(points))
+        derivs = exponents * magnitudes ** (exponents - 1.0)
+        derivs[zero] = 1.0
+        return diagonal_jacobians(derivs)
+
     def jacobian(self, point):
         """
         Since the transform does not have any cross-dependence of
@@ -189,6 +284,13 @@ class CartesianToCylindrical(XForm):
 
         return Vector((s, phi, z))
 
+    def transform_points(self, points):
+        x = points[:, 0]
+        y = points[:, 1]
+        s = np.hypot(y, x)
+        phi = np.arctan2(y, x)
+        return np.stack([s, phi, points[:, 2]], axis=1)
+
     def jacobian(self, point):
         x = point.x
         y = point.y
@@ -219,6 +321,13 @@ class CylindricalToCartesian(XForm):
 
         return Vector((x, y, z))
 
+    def transform_points(self, points):
+        s = points[:, 0]
+        phi = points[:, 1]
+        x = s * np.cos(phi)
+        y = s * np.sin(phi)
+        return np.stack([x, y, points[:, 2]], axis=1)
+
     def jacobian(self, point):
         s = point.x
         phi = point.y
@@ -250,6 +359,9 @@ class Sinusoidal(XForm):
         z = math.sin(point.z)
         return Vector((x, y, z))
 
+    def transform_points(self, points):
+        return np.sin(points)
+
     def jacobian(self, point):
         xx = math.cos(point.x)
         yy = math.cos(point.y)
@@ -284,6 +396,11 @@ class Conjugated(XForm):
         xformed = self.A.transform(change_coords)
         restore_coords = self.B.transform(xformed)  
         return restore_coords
+
+    def transform_points(self, points):
+        change_coords = self.B_inv.transform_points(points)
+        xformed = self.A.transform_points(change_coords)
+        return self.B.transform_points(xformed)
          
     def jacobian(self, point):
         """